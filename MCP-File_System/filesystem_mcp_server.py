@@ -1,4 +1,5 @@
 import os
+import mmap
 import shutil
 import sys
 import logging
@@ -9,6 +10,58 @@ logger = logging.getLogger("filesystem-mcp")
 
 mcp = FastMCP("File System Explorer")
 
+# read_file windows: bytes returned when no length is given, lines returned
+# when start_line is given without end_line, and a hard cap on any window
+READ_LENGTH = 1000
+READ_LINES = 100
+READ_MAX_BYTES = 1024 * 1024
+
+def read_window(path: str, offset: int = 0, length: int = READ_LENGTH,
+                start_line: int = None, end_line: int = None) -> str:
+    """Return a byte or line window of a file, served from an mmap so only
+    the pages of the window (and, for line windows, the newline scan) are touched."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return "[bytes 0-0 of 0; end of file]"
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = min(max(offset, 0), size)
+        # Never start or stop inside a UTF-8 sequence
+        while start < size and mm[start] & 0xC0 == 0x80:
+            start += 1
+        label = ""
+        if start_line is not None:
+            # Lines are counted from offset, so callers can jump first and then take lines
+            first = max(start_line, 1)
+            last = end_line if end_line is not None else first + READ_LINES - 1
+            for _ in range(first - 1):
+                newline = mm.find(b"\n", start)
+                start = size if newline == -1 else newline + 1
+                if start == size:
+                    break
+            end, count = start, 0
+            while count < last - first + 1 and end < size:
+                newline = mm.find(b"\n", end)
+                end = size if newline == -1 else newline + 1
+                count += 1
+            label = f"lines {first}-{first + count - 1}, " if count else f"no lines from line {first}, "
+        else:
+            end = min(start + max(length, 0), size)
+        if end - start > READ_MAX_BYTES:
+            end = start + READ_MAX_BYTES
+            label += "truncated to the size limit, "
+        requested = end
+        while start < end < size and mm[end] & 0xC0 == 0x80:
+            end -= 1
+        if end == start < requested:
+            # A window shorter than the character at start still returns that
+            # whole character, so paging by next offset always moves forward
+            end = start + 1
+            while end < size and mm[end] & 0xC0 == 0x80:
+                end += 1
+        text = mm[start:end].decode("utf-8", errors="replace")
+    more = f"next offset: {end}" if end < size else "end of file"
+    return f"{text}\n[{label}bytes {start}-{end} of {size}; {more}]"
+
 @mcp.tool(name="list_directory", description="List files and folders in a directory")
 def list_directory(path: str = ".") -> str:
     if not os.path.exists(path):
@@ -16,12 +69,11 @@ def list_directory(path: str = ".") -> str:
     items = os.listdir(path)
     return "\n".join(items) if items else f"No files or folders in '{path}'."
 
-@mcp.tool(name="read_file", description="Read the contents of a text file")
-def read_file(path: str) -> str:
+@mcp.tool(name="read_file", description="Read a text file. Returns length bytes from offset (default: the first 1000), or lines start_line to end_line counted from offset. Each response ends with the byte range, the file size and the next offset to continue from")
+def read_file(path: str, offset: int = 0, length: int = READ_LENGTH, start_line: int = None, end_line: int = None) -> str:
     if not os.path.isfile(path):
         return f"'{path}' is not a file."
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read(1000)
+    return read_window(path, offset, length, start_line, end_line)
 
 @mcp.tool(name="file_metadata", description="Get metadata for a file")
 def file_metadata(path: str) -> str:
@@ -0,0 +1,352 @@
+"""
+Benchmark the two Postgres MCP servers against a throwaway local PostgreSQL.
+
+The harness initdb's a cluster in a temp directory, seeds a synthetic table of
+configurable width and size, then drives the tools of postgres_mcp_server.py
+(sync) and postgres_mcp_server_for_claude.py (async) at increasing
+concurrency, both in-process (FastMCP.call_tool, one worker process per
+server) and over stdio (a real MCP client session). It reports p50/p95/p99
+latency, throughput and peak RSS per server process.
+
+    python benchmark.py --rows 100000 --width 40 --concurrency 1,8,32
+    python benchmark.py --transports stdio --servers async --output results.json
+
+PostgreSQL's initdb/pg_ctl/psql must be on PATH (or given with --pg-bin), and
+initdb refuses to run as root.
+"""
+import os
+import re
+import sys
+import json
+import time
+import glob
+import math
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import resource
+import importlib
+import subprocess
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVERS = {"sync": "postgres_mcp_server", "async": "postgres_mcp_server_for_claude"}
+DB_NAME = "mcp_bench"
+TABLE = "bench_wide"
+# Column types cycled through to build a table of the requested width
+COLUMN_TYPES = [
+    ("integer", "(g * 7 + {i}) % 100000"),
+    ("numeric(12,2)", "round((random() * 10000)::numeric, 2)"),
+    ("text", "md5(g::text || '{i}')"),
+    ("timestamptz", "now() - (g || ' seconds')::interval"),
+    ("jsonb", "jsonb_build_object('k', g, 'tag', md5(g::text || '{i}'))"),
+]
+TOKEN = re.compile(r"token: (\S+?)\]")
+
+Call = Callable[[str, Dict[str, Any]], Awaitable[str]]
+
+# ---------------------------------------------------------------------------
+# Throwaway PostgreSQL
+# ---------------------------------------------------------------------------
+
+def find_pg_bin(pg_bin: Optional[str]) -> str:
+    if pg_bin:
+        return pg_bin
+    initdb = shutil.which("initdb")
+    if initdb:
+        return os.path.dirname(initdb)
+    # Debian/Ubuntu and RHEL keep the binaries off PATH
+    candidates = sorted(glob.glob("/usr/lib/postgresql/*/bin/initdb") + glob.glob("/usr/pgsql-*/bin/initdb"))
+    if not candidates:
+        sys.exit("Couldn't find initdb; install PostgreSQL or pass --pg-bin")
+    return os.path.dirname(candidates[-1])
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_postgres(pg_bin: str, data_dir: str, port: int) -> None:
+    subprocess.run(
+        [os.path.join(pg_bin, "initdb"), "-D", data_dir, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    options = f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1 -c max_connections=200 -c fsync=off"
+    subprocess.run(
+        [os.path.join(pg_bin, "pg_ctl"), "-D", data_dir, "-o", options, "-l", os.path.join(data_dir, "server.log"), "-w", "start"],
+        check=True, stdout=subprocess.DEVNULL
+    )
+
+def stop_postgres(pg_bin: str, data_dir: str) -> None:
+    subprocess.run([os.path.join(pg_bin, "pg_ctl"), "-D", data_dir, "-m", "immediate", "stop"],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def psql(pg_bin: str, port: int, db_name: str, command: str) -> None:
+    subprocess.run(
+        [os.path.join(pg_bin, "psql"), "-h", "127.0.0.1", "-p", str(port), "-U", "postgres", "-d", db_name,
+         "-v", "ON_ERROR_STOP=1", "-q", "-c", command],
+        check=True
+    )
+
+def seed(pg_bin: str, port: int, rows: int, width: int) -> None:
+    """Create the benchmark database and one table with `width` columns of mixed types."""
+    psql(pg_bin, port, "postgres", f"CREATE DATABASE {DB_NAME}")
+    columns = [(f"c{i}", *COLUMN_TYPES[i % len(COLUMN_TYPES)]) for i in range(width)]
+    psql(pg_bin, port, DB_NAME, (
+        f"CREATE TABLE {TABLE} (id bigint PRIMARY KEY, "
+        + ", ".join(f"{name} {type_}" for name, type_, _ in columns) + ")"
+    ))
+    psql(pg_bin, port, DB_NAME, (
+        f"INSERT INTO {TABLE} SELECT g, "
+        + ", ".join(expression.format(i=i) for i, (_, _, expression) in enumerate(columns))
+        + f" FROM generate_series(1, {rows}) AS g"
+    ))
+    psql(pg_bin, port, DB_NAME, f"VACUUM ANALYZE {TABLE}")
+
+# ---------------------------------------------------------------------------
+# Workloads: each is (tools it needs, one operation)
+# ---------------------------------------------------------------------------
+
+async def stream_pages(call: Call, i: int) -> str:
+    """Open a streamed result, read one more page and close the cursor."""
+    text = await call("execute_query", {"db_name": DB_NAME, "query": f"SELECT * FROM {TABLE}",
+                                        "stream": True, "page_size": 500})
+    token = TOKEN.search(text)
+    if token:
+        text = await call("fetch_more", {"token": token.group(1), "page_size": 500})
+        await call("close_cursor", {"token": token.group(1)})
+    return text
+
+def workloads(rows: int) -> Dict[str, Any]:
+    def scan(fmt: str) -> Callable[[Call, int], Awaitable[str]]:
+        return lambda call, i: call("execute_query", {
+            "db_name": DB_NAME, "query": f"SELECT * FROM {TABLE} LIMIT 1000", "format": fmt,
+            "max_rows": 0, "max_bytes": 0, "use_cache": False,
+        })
+
+    return {
+        "list_tables": (["list_tables"], lambda call, i: call("list_tables", {"db_name": DB_NAME})),
+        "table_schema": (["table_schema"], lambda call, i: call("table_schema", {"db_name": DB_NAME, "table": TABLE})),
+        "view_table": (["view_table"], lambda call, i: call("view_table", {"db_name": DB_NAME, "table": TABLE})),
+        "point_lookup": (["execute_query"], lambda call, i: call("execute_query", {
+            "db_name": DB_NAME, "query": f"SELECT * FROM {TABLE} WHERE id = $1",
+            "params": [(i * 7919) % rows + 1], "use_cache": False,
+        })),
+        "scan_text": (["execute_query"], scan("text")),
+        "scan_jsonl": (["execute_query"], scan("jsonl")),
+        "stream": (["execute_query", "fetch_more", "close_cursor"], stream_pages),
+    }
+
+def percentile(sorted_ms: List[float], q: float) -> float:
+    # Nearest rank
+    return sorted_ms[max(math.ceil(q * len(sorted_ms)) - 1, 0)] if sorted_ms else 0.0
+
+async def measure(operation: Callable[[Call, int], Awaitable[str]], call: Call,
+                  concurrency: int, iterations: int) -> Dict[str, Any]:
+    """Run `iterations` operations from `concurrency` concurrent workers."""
+    latencies: List[float] = []
+    errors = 0
+    next_index = iter(range(iterations))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in next_index:
+            started = time.perf_counter()
+            try:
+                text = await operation(call, i)
+                if text.startswith("Error"):
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "ops": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "ops_per_s": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+async def run_suite(call: Call, tools: List[str], names: List[str], levels: List[int],
+                    iterations: int, rows: int) -> List[Dict[str, Any]]:
+    available = workloads(rows)
+    results = []
+    for name in names:
+        needed, operation = available[name]
+        if not all(tool in tools for tool in needed):
+            continue
+        # One untimed call warms pools, statement caches and catalog caches
+        await operation(call, 0)
+        for concurrency in levels:
+            result = await measure(operation, call, concurrency, iterations)
+            result["workload"] = name
+            results.append(result)
+    return results
+
+def result_text(result: Any) -> str:
+    # FastMCP.call_tool returns content blocks (newer versions: with structured output)
+    if isinstance(result, tuple):
+        result = result[0]
+    content = getattr(result, "content", result)
+    text = "".join(getattr(item, "text", "") for item in content)
+    return "Error: " + text if getattr(result, "isError", False) else text
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# ---------------------------------------------------------------------------
+# Transports
+# ---------------------------------------------------------------------------
+
+async def in_process_worker(args: argparse.Namespace) -> None:
+    """Runs in its own process (see run_in_process) so RSS is per server."""
+    sys.path.insert(0, HERE)
+    module = importlib.import_module(SERVERS[args.server])
+
+    async def call(name: str, arguments: Dict[str, Any]) -> str:
+        return result_text(await module.mcp.call_tool(name, arguments))
+
+    tools = [tool.name for tool in await module.mcp.list_tools()]
+    results = await run_suite(call, tools, args.workloads, args.concurrency, args.iterations, args.rows)
+    if hasattr(module, "close_pools") and asyncio.iscoroutinefunction(module.close_pools):
+        await module.close_pools()
+    for result in results:
+        result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(results))
+
+def run_in_process(server: str, args: argparse.Namespace, env: Dict[str, str]) -> List[Dict[str, Any]]:
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", "--servers", server,
+        "--workloads", ",".join(args.workloads), "--concurrency", ",".join(map(str, args.concurrency)),
+        "--iterations", str(args.iterations), "--rows", str(args.rows),
+    ]
+    done = subprocess.run(command, env=env, cwd=HERE, stdout=subprocess.PIPE, text=True)
+    if done.returncode != 0:
+        print(f"in-process run of the {server} server failed (exit {done.returncode})", file=sys.stderr)
+        return []
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+# Serve over stdio without the scripts' __main__ blocks, and report the
+# server's peak RSS on stderr when the session ends (the client may close
+# stdin or send SIGTERM)
+SERVE = (
+    "import atexit, os, resource, signal, sys\n"
+    "def peak(*_):\n"
+    "    sys.stderr.write('peak_rss_kb=%d\\n' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+    "    sys.stderr.flush()\n"
+    "atexit.register(peak)\n"
+    "signal.signal(signal.SIGTERM, lambda *_: (peak(), os._exit(0)))\n"
+    "import {module}\n"
+    "{module}.mcp.run(transport='stdio')\n"
+)
+
+async def run_stdio(server: str, args: argparse.Namespace, env: Dict[str, str]) -> List[Dict[str, Any]]:
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    params = StdioServerParameters(
+        command=sys.executable,
+        args=["-c", SERVE.format(module=SERVERS[server])],
+        env=env,
+        cwd=HERE
+    )
+    with tempfile.TemporaryFile("w+") as errlog:
+        async with stdio_client(params, errlog=errlog) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+
+                async def call(name: str, arguments: Dict[str, Any]) -> str:
+                    return result_text(await session.call_tool(name, arguments))
+
+                tools = [tool.name for tool in (await session.list_tools()).tools]
+                results = await run_suite(call, tools, args.workloads, args.concurrency, args.iterations, args.rows)
+        # Give the server a moment to write its peak after the session closes
+        await asyncio.sleep(0.5)
+        errlog.seek(0)
+        peaks = re.findall(r"peak_rss_kb=(\d+)", errlog.read())
+    for result in results:
+        result["peak_rss_mb"] = int(peaks[-1]) / 1024 if peaks else None
+    return results
+
+# ---------------------------------------------------------------------------
+
+def report(results: List[Dict[str, Any]]) -> None:
+    header = f"{'transport':<11}{'server':<7}{'workload':<14}{'conc':>5}{'ops':>7}{'errors':>7}" \
+             f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak RSS MB':>13}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.1f}" if r.get("peak_rss_mb") is not None else "n/a"
+        print(f"{r['transport']:<11}{r['server']:<7}{r['workload']:<14}{r['concurrency']:>5}{r['ops']:>7}{r['errors']:>7}"
+              f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['ops_per_s']:>10.1f}{rss:>13}")
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the sync and async Postgres MCP servers")
+    parser.add_argument("--rows", type=int, default=10000, help="rows in the synthetic table")
+    parser.add_argument("--width", type=int, default=20, help="columns in the synthetic table (besides id)")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--iterations", type=int, default=200, help="operations per workload and level")
+    parser.add_argument("--servers", default="sync,async", help="comma-separated: sync, async")
+    parser.add_argument("--transports", default="in-process,stdio", help="comma-separated: in-process, stdio")
+    parser.add_argument("--workloads", default=",".join(workloads(1)), help="comma-separated workload names")
+    parser.add_argument("--pg-bin", help="directory holding initdb, pg_ctl and psql")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    args.servers = [server.strip() for server in args.servers.split(",")]
+    args.transports = [transport.strip() for transport in args.transports.split(",")]
+    args.workloads = [name.strip() for name in args.workloads.split(",")]
+    unknown = [name for name in args.workloads if name not in workloads(1)]
+    if unknown or any(server not in SERVERS for server in args.servers):
+        parser.error(f"unknown workload or server: {', '.join(unknown) or args.servers}")
+    return args
+
+async def main(args: argparse.Namespace) -> None:
+    pg_bin = find_pg_bin(args.pg_bin)
+    data_dir = tempfile.mkdtemp(prefix="mcp-pg-bench-")
+    port = free_port()
+    try:
+        print(f"Starting PostgreSQL on port {port} ({data_dir})...")
+        start_postgres(pg_bin, data_dir, port)
+        print(f"Seeding {args.rows} rows x {args.width} columns...")
+        seed(pg_bin, port, args.rows, args.width)
+        env = dict(os.environ, PG_HOST="127.0.0.1", PG_PORT=str(port), PG_USER="postgres", PG_PASS="")
+
+        results = []
+        for transport in args.transports:
+            for server in args.servers:
+                print(f"Running {server} server {transport}...")
+                if transport == "in-process":
+                    runs = run_in_process(server, args, env)
+                else:
+                    runs = await run_stdio(server, args, env)
+                for result in runs:
+                    result.update(transport=transport, server=server)
+                results += runs
+        print()
+        report(results)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"rows": args.rows, "width": args.width, "results": results}, f, indent=2)
+    finally:
+        stop_postgres(pg_bin, data_dir)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.worker:
+        arguments.server = arguments.servers[0]
+        asyncio.run(in_process_worker(arguments))
+    else:
+        asyncio.run(main(arguments))
@@ -1,7 +1,16 @@
 import os
+import re
 import sys
+import time
+import itertools
+import atexit
 import logging
+import threading
+import gzip
 import psycopg2
+from contextlib import contextmanager
+from psycopg2 import extensions, extras, sql
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 from mcp.server.fastmcp import FastMCP
 
@@ -10,87 +19,429 @@ load_dotenv()
 
 mcp = FastMCP("Postgres Explorer")
 
-def connect(db_name: str):
-    return psycopg2.connect(
+# Pool settings (read once at startup)
+POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+# Connections idle longer than this are pinged before being handed out
+POOL_PING_AFTER = float(os.getenv("PG_POOL_PING_AFTER", "30"))
+
+# Server-wide statement_timeout for every pooled connection (0 = none)
+STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "30000"))
+
+# Bulk COPY settings
+COPY_CHUNK_SIZE = int(os.getenv("PG_COPY_CHUNK_SIZE", str(1024 * 1024)))
+COPY_FORMATS = {
+    "csv": "FORMAT csv, HEADER {header}",
+    "tsv": "FORMAT csv, HEADER {header}, DELIMITER E'\\t'",
+    "binary": "FORMAT binary",
+}
+
+# Read replicas as "host:port" entries; reads go to one whose replay lag is under the ceiling
+REPLICA_HOSTS = [entry.strip() for entry in os.getenv("PG_REPLICA_HOSTS", "").split(",") if entry.strip()]
+REPLICA_STRATEGY = os.getenv("PG_REPLICA_STRATEGY", "round-robin")  # or "least-latency"
+REPLICA_MAX_LAG = float(os.getenv("PG_REPLICA_MAX_LAG", "10"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("PG_REPLICA_CHECK_INTERVAL", "5"))
+
+# One pool per (database name, replica), replica None being the primary; the
+# semaphore makes callers wait for a free connection instead of
+# ThreadedConnectionPool raising "pool exhausted".
+_pools = {}
+_pool_slots = {}
+_pools_lock = threading.Lock()
+# Release time of each idle pooled connection, by id(); entries are dropped when the connection is closed
+_last_used = {}
+
+class IdlePool(ThreadedConnectionPool):
+    """ThreadedConnectionPool that keeps up to maxconn connections idle.
+
+    psycopg2 closes every returned connection once minconn are idle, so with
+    the default minconn of 1 concurrent callers would reconnect on almost
+    every checkout. minconn still sets how many connections are opened upfront.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.minconn = maxconn
+
+def connection_kwargs(db_name: str, replica: str = None) -> dict:
+    host, port = os.getenv("PG_HOST", "localhost"), os.getenv("PG_PORT", "5432")
+    extra = {}
+    if replica:
+        host, _, replica_port = replica.partition(":")
+        port = replica_port or port
+        # Don't let a dead replica stall a call for the default TCP timeout
+        extra["connect_timeout"] = max(int(REPLICA_CHECK_INTERVAL), 1)
+    return dict(
         dbname=db_name,
         user=os.getenv("PG_USER", "postgres"),
         password=os.getenv("PG_PASS", "your_password"),
-        host=os.getenv("PG_HOST", "localhost"),
-        port=os.getenv("PG_PORT", "5432")
+        host=host,
+        port=port,
+        options=f"-c statement_timeout={STATEMENT_TIMEOUT_MS}",
+        **extra
     )
 
+def get_pool(db_name: str, replica: str = None) -> ThreadedConnectionPool:
+    key = (db_name, replica)
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+    # Connect outside the lock so a slow or dead host only stalls the callers
+    # that need it; if two threads race, the loser closes its pool.
+    pool = IdlePool(POOL_MIN_SIZE, POOL_MAX_SIZE, **connection_kwargs(db_name, replica))
+    with _pools_lock:
+        existing = _pools.get(key)
+        if existing is None:
+            # Slots first: connect() reads them right after finding the pool
+            _pool_slots[key] = threading.BoundedSemaphore(POOL_MAX_SIZE)
+            _pools[key] = pool
+            logging.info(f"Created connection pool for database: {db_name}" + (f" on replica {replica}" if replica else ""))
+            return pool
+    pool.closeall()
+    return existing
+
+# Replica health is checked every REPLICA_CHECK_INTERVAL by one daemon thread
+# per replica, started with the first read, so a dead replica never stalls a call.
+_replicas = {
+    replica: {"healthy": False, "lag": None, "latency": None, "checked": 0.0}
+    for replica in REPLICA_HOSTS
+}
+_replica_turn = itertools.count()
+_replica_monitors = []
+_replica_monitors_lock = threading.Lock()
+
+# Replay lag in seconds; 0 when everything received has been replayed, since
+# pg_last_xact_replay_timestamp() stops moving while the primary is idle.
+REPLICA_LAG_SQL = """
+SELECT CASE
+         WHEN NOT pg_is_in_recovery() THEN NULL
+         WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+         ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END;
+"""
+
+def check_replica(replica: str):
+    state = _replicas[replica]
+    try:
+        started = time.perf_counter()
+        with connect("postgres", replica=replica) as conn, conn.cursor() as cur:
+            cur.execute(REPLICA_LAG_SQL)
+            lag = cur.fetchone()[0]
+        latency = time.perf_counter() - started
+        if lag is None:
+            logging.warning(f"Replica {replica} is not in recovery; not routing reads to it")
+        state["healthy"] = lag is not None
+        state["lag"] = None if lag is None else float(lag)
+        # Smoothed round-trip time for least-latency routing
+        state["latency"] = latency if state["latency"] is None else 0.8 * state["latency"] + 0.2 * latency
+    except Exception as e:
+        if state["healthy"]:
+            logging.warning(f"Replica {replica} failed its health check: {e}")
+        state["healthy"] = False
+    finally:
+        state["checked"] = time.monotonic()
+
+def monitor_replica(replica: str):
+    while True:
+        check_replica(replica)
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+def start_replica_monitors():
+    with _replica_monitors_lock:
+        if _replica_monitors:
+            return
+        for replica in _replicas:
+            thread = threading.Thread(target=monitor_replica, args=(replica,), name=f"replica-check-{replica}", daemon=True)
+            thread.start()
+            _replica_monitors.append(thread)
+
+def choose_replica():
+    """Pick a healthy replica within the lag ceiling, or None for the primary."""
+    if not _replica_monitors:
+        start_replica_monitors()
+    candidates = [
+        replica for replica, state in _replicas.items()
+        if state["healthy"] and state["lag"] is not None and state["lag"] <= REPLICA_MAX_LAG
+    ]
+    if not candidates:
+        return None
+    if REPLICA_STRATEGY == "least-latency":
+        return min(candidates, key=lambda replica: _replicas[replica]["latency"])
+    return candidates[next(_replica_turn) % len(candidates)]
+
+_DML_KEYWORD = re.compile(r"\b(?:INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+def is_read_query(query: str) -> bool:
+    """Same classification as the async server's replica_safe: EXPLAIN ANALYZE
+    of a write, in any spelling or option list, executes the write."""
+    words = query.strip().upper().split()
+    if not words:
+        return False
+    if words[0] in ("SELECT", "SHOW", "EXPLAIN"):
+        return not (words[0] == "EXPLAIN" and re.search(r"\bANALY[SZ]E\b", query, re.IGNORECASE)
+                    and _DML_KEYWORD.search(query))
+    return words[0] == "WITH" and not _DML_KEYWORD.search(query)
+
+def is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is not None and time.monotonic() - last_used < POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+def checkout(pool: ThreadedConnectionPool):
+    # Every idle connection may be stale after a server restart, so keep
+    # discarding until a healthy one (or a freshly opened one) turns up.
+    for _ in range(POOL_MAX_SIZE + 1):
+        conn = pool.getconn()
+        if not conn.closed:
+            conn.autocommit = True
+        if is_healthy(conn):
+            return conn
+        logging.warning("Discarding broken pooled connection and reconnecting")
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("Could not obtain a healthy connection from the pool")
+
+def release(pool: ThreadedConnectionPool, conn, broken: bool = False):
+    if not broken and not conn.closed:
+        try:
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if broken or conn.closed:
+        # Drop the dead connection so the next checkout reconnects
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    else:
+        pool.putconn(conn)
+        # putconn closes connections it can't keep; only record the ones kept
+        if conn.closed:
+            _last_used.pop(id(conn), None)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+
+def route(db_name: str, read_only: bool):
+    """(pool key replica, pool) for a call: a replica for reads when one is usable, else the primary."""
+    replica = choose_replica() if read_only and _replicas else None
+    if replica is not None:
+        try:
+            return replica, get_pool(db_name, replica)
+        except psycopg2.Error as e:
+            logging.warning(f"Replica {replica} unavailable, reading from primary: {e}")
+            _replicas[replica]["healthy"] = False
+    return None, get_pool(db_name)
+
+@contextmanager
+def connect(db_name: str, read_only: bool = False, replica: str = None):
+    if replica is not None:
+        pool = get_pool(db_name, replica)
+    else:
+        replica, pool = route(db_name, read_only)
+    slots = _pool_slots[(db_name, replica)]
+    slots.acquire()
+    try:
+        conn = checkout(pool)
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            release(pool, conn, broken=True)
+            raise
+        except BaseException:
+            release(pool, conn)
+            raise
+        else:
+            release(pool, conn)
+    finally:
+        slots.release()
+
+@contextmanager
+def statement_timeout(cur, timeout_ms: int):
+    """Override statement_timeout on a pooled connection for the duration of a call."""
+    if timeout_ms == STATEMENT_TIMEOUT_MS:
+        yield
+        return
+    cur.execute("SET statement_timeout = %s", (max(int(timeout_ms), 0),))
+    try:
+        yield
+    finally:
+        try:
+            cur.execute("RESET statement_timeout")
+        except psycopg2.Error:
+            pass
+
+def close_pools():
+    with _pools_lock:
+        for (db_name, _), pool in _pools.items():
+            pool.closeall()
+            logging.info(f"Closed connection pool for database: {db_name}")
+        _pools.clear()
+        _pool_slots.clear()
+        _last_used.clear()
+
+atexit.register(close_pools)
+
 
 @mcp.tool(name="list_tables", description="List all public tables in the given PostgreSQL database")
 def list_tables(db_name: str) -> str:
     try:
-        conn = connect(db_name)
-        cur = conn.cursor()
-        cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public';")
-        tables = cur.fetchall()
+        with connect(db_name) as conn, conn.cursor() as cur:
+            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public';")
+            tables = cur.fetchall()
         return "\n".join(table[0] for table in tables) if tables else f"No public tables found in database '{db_name}'."
     except Exception as e:
         logging.error(f"Error listing tables from {db_name}: {e}")
         return f"Error: {str(e)}"
-    finally:
-        if 'cur' in locals(): cur.close()
-        if 'conn' in locals(): conn.close()
 
 
 @mcp.tool(name="table_schema", description="Get the schema of a table in the specified database")
 def table_schema(db_name: str, table: str) -> str:
     try:
-        conn = connect(db_name)
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s",
-            (table,)
-        )
-        schema = cur.fetchall()
+        with connect(db_name) as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s",
+                (table,)
+            )
+            schema = cur.fetchall()
         return "\n".join(f"{col}: {dtype}" for col, dtype in schema) if schema else f"No schema found for table '{table}' in '{db_name}'."
     except Exception as e:
         logging.error(f"Error retrieving schema from {db_name}: {e}")
         return f"Error: {str(e)}"
-    finally:
-        if 'cur' in locals(): cur.close()
-        if 'conn' in locals(): conn.close()
 
 
 @mcp.tool(name="view_table", description="View first 10 rows of a table from the specified database")
 def view_table(db_name: str, table: str) -> str:
     try:
-        conn = connect(db_name)
-        cur = conn.cursor()
-        cur.execute(f'SELECT * FROM "{table}" LIMIT 10')
-        rows = cur.fetchall()
-        colnames = [desc[0] for desc in cur.description]
+        with connect(db_name, read_only=True) as conn, conn.cursor() as cur:
+            cur.execute(f'SELECT * FROM "{table}" LIMIT 10')
+            rows = cur.fetchall()
+            colnames = [desc[0] for desc in cur.description]
         return "\n".join(str(dict(zip(colnames, row))) for row in rows) if rows else f"No rows found in '{table}' from '{db_name}'."
     except Exception as e:
         logging.error(f"Error viewing table {table} from {db_name}: {e}")
         return f"Error: {str(e)}"
-    finally:
-        if 'cur' in locals(): cur.close()
-        if 'conn' in locals(): conn.close()
         
 @mcp.tool(name="list_databases", description="List all PostgreSQL databases")
 def list_databases() -> str:
     try:
-        conn = psycopg2.connect(
-            dbname="postgres",
-            user=os.getenv("PG_USER", "postgres"),
-            password=os.getenv("PG_PASS", "your_password"),
-            host=os.getenv("PG_HOST", "localhost"),
-            port=os.getenv("PG_PORT", "5432")
-        )
-        cur = conn.cursor()
-        cur.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
-        databases = cur.fetchall()
+        with connect("postgres") as conn, conn.cursor() as cur:
+            cur.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
+            databases = cur.fetchall()
         return "\n".join(db[0] for db in databases) if databases else "No databases found."
     except Exception as e:
         logging.error(f"Error listing databases: {e}")
         return f"Error: {str(e)}"
-    finally:
-        if 'cur' in locals(): cur.close()
-        if 'conn' in locals(): conn.close()
+
+@mcp.tool(name="import_file", description="Bulk-load a local csv, tsv or binary (COPY format) file into a table with COPY")
+def import_file(db_name: str, table: str, path: str, format: str = "csv", header: bool = True, schema: str = None,
+                timeout_ms: int = 0) -> str:
+    if format not in COPY_FORMATS:
+        return f"Error: Unknown format '{format}'. Use one of: {', '.join(COPY_FORMATS)}"
+    if not os.path.isfile(path):
+        return f"Error: '{path}' is not a file."
+    try:
+        target = sql.Identifier(schema, table) if schema else sql.Identifier(table)
+        options = COPY_FORMATS[format].format(header="true" if header else "false")
+        copy = sql.SQL("COPY {} FROM STDIN WITH (" + options + ")").format(target)
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        with connect(db_name) as conn, conn.cursor() as cur, open(path, "rb") as f:
+            with statement_timeout(cur, timeout_ms):
+                cur.copy_expert(copy.as_string(conn), f, size=COPY_CHUNK_SIZE)
+                rows = cur.rowcount
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        return (
+            f"Imported {rows} rows, {size / 1024 / 1024:.1f} MB in {elapsed:.2f}s "
+            f"({rows / elapsed:,.0f} rows/s, {size / 1024 / 1024 / elapsed:.1f} MB/s) into '{table}'."
+        )
+    except Exception as e:
+        logging.error(f"Error importing {path} into {table} in {db_name}: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="export_query", description="Export a query's results straight to a local csv, tsv or binary file with COPY TO (optionally gzip-compressed)")
+def export_query(db_name: str, query: str, path: str, format: str = "csv", header: bool = True, compress: bool = False,
+                 timeout_ms: int = 0) -> str:
+    if format not in COPY_FORMATS:
+        return f"Error: Unknown format '{format}'. Use one of: {', '.join(COPY_FORMATS)}"
+    compress = compress or path.endswith(".gz")
+    try:
+        options = COPY_FORMATS[format].format(header="true" if header else "false")
+        copy = "COPY (" + query.strip().rstrip(";") + ") TO STDOUT WITH (" + options + ")"
+        started = time.perf_counter()
+        with connect(db_name, read_only=is_read_query(query)) as conn, conn.cursor() as cur, \
+                (gzip.open if compress else open)(path, "wb") as f:
+            with statement_timeout(cur, timeout_ms):
+                cur.copy_expert(copy, f, size=COPY_CHUNK_SIZE)
+                rows = cur.rowcount
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        size = os.path.getsize(path)
+        kind = "gzip-compressed " if compress else ""
+        return (
+            f"Exported {rows} rows, {size / 1024 / 1024:.1f} MB in {elapsed:.2f}s "
+            f"({rows / elapsed:,.0f} rows/s, {size / 1024 / 1024 / elapsed:.1f} MB/s) to {kind}'{path}'."
+        )
+    except Exception as e:
+        logging.error(f"Error exporting query from {db_name} to {path}: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="execute_batch", description="Run many statements in one call: either a list of SQL statements, or one query (%s placeholders, or 'VALUES %s' for multi-row inserts) with a list of parameter sets. atomic=True (default) runs everything in one transaction; atomic=False reports a status per statement")
+def execute_batch(db_name: str, statements: list = None, query: str = None, params_list: list = None,
+                  atomic: bool = True) -> str:
+    if (statements is None) == (query is None):
+        return "Error: Pass either statements, or query with params_list."
+    if query is not None and not params_list:
+        return "Error: params_list must hold at least one parameter set."
+    if statements is not None and not statements:
+        return "Error: statements is empty."
+    started = time.perf_counter()
+    try:
+        with connect(db_name) as conn, conn.cursor() as cur:
+            if atomic:
+                conn.autocommit = False
+                try:
+                    if query is not None and re.search(r"\bVALUES\s+%s", query, re.IGNORECASE):
+                        # One multi-row VALUES list per page instead of a statement per row
+                        extras.execute_values(cur, query, params_list, page_size=1000)
+                    elif query is not None:
+                        extras.execute_batch(cur, query, params_list, page_size=100)
+                    else:
+                        cur.execute(";\n".join(statement.strip().rstrip(";") for statement in statements))
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+                count = len(params_list) if query is not None else len(statements)
+                kind = "parameter sets" if query is not None else "statements"
+                elapsed = (time.perf_counter() - started) * 1000
+                return f"Executed {count} {kind} atomically in {elapsed:.1f} ms."
+
+            work = [(query, params) for params in params_list] if query is not None else [(statement, None) for statement in statements]
+            lines = []
+            for i, (statement, params) in enumerate(work, 1):
+                try:
+                    cur.execute(statement, params)
+                    lines.append(f"{i}. {cur.statusmessage}")
+                except psycopg2.DatabaseError as e:
+                    lines.append(f"{i}. Error: {str(e).strip()}")
+            failed = sum(1 for line in lines if ". Error: " in line)
+            elapsed = (time.perf_counter() - started) * 1000
+            return "\n".join(lines) + f"\n[{len(work) - failed} succeeded, {failed} failed in {elapsed:.1f} ms]"
+    except Exception as e:
+        logging.error(f"Batch execution error on {db_name}: {e}")
+        if atomic:
+            return f"Error: {str(e)}. The batch was rolled back; nothing was committed."
+        return f"Error: {str(e)}"
 
 @mcp.tool(name="hello_postgres", description="Test tool for Postgres server")
 def hello_postgres(name: str = "World") -> str:
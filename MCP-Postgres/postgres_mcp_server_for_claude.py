@@ -1,10 +1,28 @@
 import os
 import sys
+import time
+import asyncio
 import logging
+import secrets
+import json
+import csv
+import io
+import gzip
+import base64
+import re
+import math
+import weakref
+import itertools
+import functools
+import bisect
+import contextvars
+import operator
 import asyncpg
-from typing import Any, List, Dict
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Dict, Optional, Set, Tuple
 from dotenv import load_dotenv
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -13,121 +31,2443 @@ logger = logging.getLogger("postgres-mcp")
 # Load environment variables
 load_dotenv()
 
-# Initialize FastMCP
-mcp = FastMCP("Postgres Explorer")
+# Pool settings (read once at startup)
+POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+POOL_MAX_IDLE = float(os.getenv("PG_POOL_MAX_IDLE", "300"))
+POOL_MAX_QUERIES = int(os.getenv("PG_POOL_MAX_QUERIES", "50000"))
+
+# Streaming cursors idle longer than this are closed and their connection released
+CURSOR_TTL = float(os.getenv("PG_CURSOR_TTL", "300"))
+# Open cursors and transaction handles each pin a connection, so per pool both
+# are capped to leave connections free for other calls
+MAX_STREAMS = int(os.getenv("PG_MAX_STREAMS", str(max((POOL_MAX_SIZE - 1) // 2, 1))))
+STREAM_PAGE_SIZE = int(os.getenv("PG_STREAM_PAGE_SIZE", "100"))
+
+# Default result budgets for execute_query (0 = unlimited). Rows are fetched and
+# encoded in batches, and output stops at whichever budget is hit first.
+MAX_ROWS = int(os.getenv("PG_MAX_ROWS", "1000"))
+MAX_BYTES = int(os.getenv("PG_MAX_BYTES", "100000"))
+BUDGET_FETCH_SIZE = 500
+
+# Open transaction handles idle longer than this are rolled back
+TRANSACTION_TTL = float(os.getenv("PG_TRANSACTION_TTL", "60"))
+MAX_TRANSACTIONS = int(os.getenv("PG_MAX_TRANSACTIONS", str(max((POOL_MAX_SIZE - 1) // 2, 1))))
+TRANSACTION_ISOLATION = ("read_committed", "repeatable_read", "serializable")
+
+# LISTEN/NOTIFY: notifications kept per subscription (oldest dropped first)
+# and the longest a poll_notifications call may wait
+NOTIFY_BUFFER_SIZE = int(os.getenv("PG_NOTIFY_BUFFER_SIZE", "1000"))
+NOTIFY_MAX_WAIT_MS = 60000
+
+# Prepared statements kept per pooled connection (LRU)
+STATEMENT_CACHE_SIZE = int(os.getenv("PG_STATEMENT_CACHE_SIZE", "100"))
+# Longer query texts are never cached by asyncpg (its default, set explicitly to match the counters)
+STATEMENT_CACHE_MAX_QUERY = 15 * 1024
+
+# sample_table reads at least this many pages, so small samples aren't often empty
+SAMPLE_MIN_PAGES = 8
+
+# Opt-in result cache for read queries: a TTL of 0 keeps it disabled
+RESULT_CACHE_TTL = float(os.getenv("PG_RESULT_CACHE_TTL", "0"))
+RESULT_CACHE_SIZE = int(os.getenv("PG_RESULT_CACHE_SIZE", "256"))
+
+# Bulk COPY settings
+COPY_CHUNK_SIZE = int(os.getenv("PG_COPY_CHUNK_SIZE", str(1024 * 1024)))
+
+# Server-wide statement_timeout; tools accept timeout_ms to override it per call (0 = none).
+# The client gives the server this much extra time to report the timeout itself.
+STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "30000"))
+CLIENT_TIMEOUT_GRACE = 1.0
+
+# profile_query: sequential scans over tables with more rows than this are flagged
+PROFILE_LARGE_TABLE_ROWS = int(os.getenv("PG_PROFILE_LARGE_TABLE_ROWS", "100000"))
+PROFILE_TOP_NODES = 5
+
+# suggest_indexes: tables smaller than this are cheap to scan and get no suggestions
+INDEX_MIN_ROWS = 1000
+
+# execute_across_databases: how many databases are queried at once
+FANOUT_CONCURRENCY = int(os.getenv("PG_FANOUT_CONCURRENCY", "8"))
+# Pools kept open at once; past this the least recently used idle pool is
+# closed, so a fan-out over many databases doesn't hold a connection to each
+MAX_POOLS = int(os.getenv("PG_MAX_POOLS", "32"))
+
+# Read replicas as "host:port" entries; reads go to one whose replay lag is under the ceiling
+REPLICA_HOSTS = [entry.strip() for entry in os.getenv("PG_REPLICA_HOSTS", "").split(",") if entry.strip()]
+REPLICA_STRATEGY = os.getenv("PG_REPLICA_STRATEGY", "round-robin")  # or "least-latency"
+REPLICA_MAX_LAG = float(os.getenv("PG_REPLICA_MAX_LAG", "10"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("PG_REPLICA_CHECK_INTERVAL", "5"))
+
+# One lazily created pool per (database name, replica); replica None is the primary.
+# Creation is locked per key, so a slow or dead host only stalls the callers that need it.
+_pools: "OrderedDict[Tuple[str, Optional[str]], asyncpg.Pool]" = OrderedDict()
+_pool_locks: Dict[Tuple[str, Optional[str]], asyncio.Lock] = {}
+
+def connection_kwargs(db_name: str, replica: Optional[str] = None) -> Dict[str, Any]:
+    """Connection settings for a database, taken from the environment."""
+    host, port = os.getenv("PG_HOST", "localhost"), os.getenv("PG_PORT", "5432")
+    extra = {}
+    if replica:
+        host, _, replica_port = replica.partition(":")
+        port = replica_port or port
+        # Don't let a dead replica stall pool creation for asyncpg's 60s default
+        extra["timeout"] = max(REPLICA_CHECK_INTERVAL, 1.0)
+    return dict(
+        database=db_name,
+        user=os.getenv("PG_USER", "postgres"),
+        password=os.getenv("PG_PASS", "your_password"),
+        host=host,
+        port=port,
+        **extra
+    )
+
+def encode_json(value: Any) -> str:
+    # Strings are passed through as JSON text, as they were before the codec
+    return value if isinstance(value, str) else json.dumps(value)
+
+def encode_temporal(value: Any) -> str:
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
 
-# Helper function to connect to the database
-async def connect(db_name: str) -> asyncpg.Connection:
+def decode_timestamp(text: str) -> str:
+    # DateStyle ISO prints "2024-01-31 12:00:00+00"; make it ISO 8601
+    return text.replace(" ", "T", 1)
+
+async def init_connection(conn: asyncpg.Connection) -> None:
+    """Register codecs on each new pooled connection so values arrive ready to
+    serialize: json/jsonb decoded once, numeric as exact strings, timestamps and
+    dates as ISO 8601 strings. Parameters of these types also accept strings."""
+    for typename in ("json", "jsonb"):
+        await conn.set_type_codec(typename, schema="pg_catalog", encoder=encode_json, decoder=json.loads, format="text")
+    await conn.set_type_codec("numeric", schema="pg_catalog", encoder=str, decoder=str, format="text")
+    for typename in ("timestamp", "timestamptz"):
+        await conn.set_type_codec(typename, schema="pg_catalog", encoder=encode_temporal, decoder=decode_timestamp, format="text")
+    await conn.set_type_codec("date", schema="pg_catalog", encoder=encode_temporal, decoder=str, format="text")
+
+async def get_pool(db_name: str, replica: Optional[str] = None) -> asyncpg.Pool:
+    """Return the pool for a database, creating it on first use."""
+    key = (db_name, replica)
+    pool = _pools.get(key)
+    if pool is not None:
+        _pools.move_to_end(key)
+        return pool
+    async with _pool_locks.setdefault(key, asyncio.Lock()):
+        pool = _pools.get(key)
+        if pool is None:
+            try:
+                pool = await asyncpg.create_pool(
+                    **connection_kwargs(db_name, replica),
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=POOL_MAX_IDLE,
+                    max_queries=POOL_MAX_QUERIES,
+                    init=init_connection,
+                    statement_cache_size=STATEMENT_CACHE_SIZE,
+                    max_cacheable_statement_size=STATEMENT_CACHE_MAX_QUERY,
+                    server_settings={"statement_timeout": str(STATEMENT_TIMEOUT_MS), "DateStyle": "ISO"}
+                )
+            except Exception as e:
+                logger.error(f"Connection error: {e}")
+                raise
+            _pools[key] = pool
+            logger.info(f"Created connection pool for database: {db_name}" + (f" on replica {replica}" if replica else ""))
+            await evict_pools()
+    return pool
+
+async def evict_pools() -> None:
+    """Close least recently used pools past MAX_POOLS. Pools with connections
+    lent out (including pinned cursors and transactions) are skipped."""
+    for key in list(_pools)[:-1]:
+        if len(_pools) <= MAX_POOLS:
+            break
+        pool = _pools[key]
+        if pool.get_idle_size() < pool.get_size():
+            continue
+        del _pools[key]
+        _pool_locks.pop(key, None)
+        await close_pool(key[0], pool)
+
+# Health of each replica, refreshed by monitor_replicas(). Replicas start
+# unchecked, so reads stay on the primary until the first check passes.
+_replicas: Dict[str, Dict[str, Any]] = {
+    replica: {"healthy": False, "lag": None, "latency": None} for replica in REPLICA_HOSTS
+}
+_replica_turn = itertools.count()
+
+# Replay lag in seconds; 0 when everything received has been replayed, since
+# pg_last_xact_replay_timestamp() stops moving while the primary is idle.
+REPLICA_LAG_SQL = """
+SELECT CASE
+         WHEN NOT pg_is_in_recovery() THEN NULL
+         WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+         ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp())::float8, 0)
+       END;
+"""
+
+async def check_replica(replica: str) -> None:
+    state = _replicas[replica]
     try:
-        conn = await asyncpg.connect(
-            database=db_name,
-            user=os.getenv("PG_USER", "postgres"),
-            password=os.getenv("PG_PASS", "your_password"),
-            host=os.getenv("PG_HOST", "localhost"),
-            port=os.getenv("PG_PORT", "5432")
+        pool = await get_pool("postgres", replica)
+        started = time.perf_counter()
+        async with pool.acquire(timeout=REPLICA_CHECK_INTERVAL) as conn:
+            lag = await conn.fetchval(REPLICA_LAG_SQL, timeout=REPLICA_CHECK_INTERVAL)
+        latency = time.perf_counter() - started
+        if lag is None:
+            logger.warning(f"Replica {replica} is not in recovery; not routing reads to it")
+        state["healthy"] = lag is not None
+        state["lag"] = lag
+        # Smoothed round-trip time for least-latency routing
+        state["latency"] = latency if state["latency"] is None else 0.8 * state["latency"] + 0.2 * latency
+    except Exception as e:
+        if state["healthy"]:
+            logger.warning(f"Replica {replica} failed its health check: {e}")
+        state["healthy"] = False
+
+async def monitor_replicas() -> None:
+    while True:
+        await asyncio.gather(*(check_replica(replica) for replica in _replicas))
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+
+def choose_replica() -> Optional[str]:
+    """Pick a healthy replica within the lag ceiling, or None for the primary."""
+    candidates = [
+        replica for replica, state in _replicas.items()
+        if state["healthy"] and state["lag"] is not None and state["lag"] <= REPLICA_MAX_LAG
+    ]
+    if not candidates:
+        return None
+    if REPLICA_STRATEGY == "least-latency":
+        return min(candidates, key=lambda replica: _replicas[replica]["latency"])
+    return candidates[next(_replica_turn) % len(candidates)]
+
+async def route_pool(db_name: str, read_only: bool = False) -> asyncpg.Pool:
+    """Pool to run a statement on: a replica for reads when one is usable, else the primary."""
+    replica = choose_replica() if read_only else None
+    if replica is not None:
+        try:
+            return await get_pool(db_name, replica)
+        except Exception as e:
+            logger.warning(f"Replica {replica} unavailable, reading from primary: {e}")
+            _replicas[replica]["healthy"] = False
+    return await get_pool(db_name)
+
+# query_insights: statements from pg_stat_statements, for the current database.
+# PostgreSQL 13 renamed total_time/mean_time to total_exec_time/mean_exec_time.
+STAT_STATEMENTS_ORDER = {"total_time": "total_ms", "mean_time": "mean_ms", "calls": "calls", "reads": "shared_blks_read"}
+STAT_STATEMENTS_SQL = """
+SELECT calls, {total} AS total_ms, {mean} AS mean_ms, rows, shared_blks_hit, shared_blks_read,
+       left(regexp_replace(query, '\\s+', ' ', 'g'), 300) AS query
+  FROM pg_stat_statements
+ WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+ ORDER BY {order} DESC
+ LIMIT $1;
+"""
+
+def format_statement_stats(rows: List[asyncpg.Record], order_by: str) -> str:
+    lines = [f"Top {len(rows)} statements by {order_by.replace('_', ' ')} (pg_stat_statements):"]
+    for i, row in enumerate(rows, 1):
+        blocks = row["shared_blks_hit"] + row["shared_blks_read"]
+        hit_ratio = f"{row['shared_blks_hit'] / blocks:.1%}" if blocks else "n/a"
+        lines.append(
+            f"{i}. {row['total_ms']:.1f} ms total, {row['mean_ms']:.2f} ms mean, {row['calls']} calls, "
+            f"{row['rows']} rows, cache hits {hit_ratio} ({row['shared_blks_hit']} hit / {row['shared_blks_read']} read)"
         )
-        logger.info(f"Connected to database: {db_name}")
-        return conn
+        lines.append(f"   {row['query']}")
+    return "\n".join(lines)
+
+def format_latency() -> str:
+    """Per-tool latency histograms recorded by this server process."""
+    if not _latency:
+        return "Tool latency: nothing recorded yet."
+    lines = ["Tool latency in this server process (ms; percentiles are histogram bucket bounds):"]
+    tools = sorted({tool for tool, _ in _latency}, key=lambda tool: -_latency.get((tool, "total"), {"total_ms": 0})["total_ms"])
+    for tool in tools:
+        lines.append(f"{tool}:")
+        for phase in LATENCY_PHASES:
+            histogram = _latency.get((tool, phase))
+            if histogram is None:
+                continue
+            lines.append(
+                f"  {phase}: {histogram['count']} samples, mean {histogram['total_ms'] / histogram['count']:.1f}, "
+                f"p50 {latency_percentile(histogram, 0.5)}, p95 {latency_percentile(histogram, 0.95)}, "
+                f"p99 {latency_percentile(histogram, 0.99)}, max {histogram['max_ms']:.1f}"
+            )
+    return "\n".join(lines)
+
+# Per-tool latency histograms for query_insights, keyed by (tool, phase). Phases
+# are "total" (the whole call), "pool_wait", "execute" and "serialize".
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+LATENCY_PHASES = ("total", "pool_wait", "execute", "serialize")
+_latency: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_current_tool: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_tool", default=None)
+
+def record_latency(phase: str, seconds: float, tool: Optional[str] = None) -> None:
+    """Add a timing to the histogram of the tool currently running."""
+    tool = tool or _current_tool.get()
+    if tool is None:
+        return
+    histogram = _latency.get((tool, phase))
+    if histogram is None:
+        histogram = _latency[(tool, phase)] = {
+            "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1), "count": 0, "total_ms": 0.0, "max_ms": 0.0
+        }
+    ms = seconds * 1000
+    histogram["buckets"][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+    histogram["count"] += 1
+    histogram["total_ms"] += ms
+    histogram["max_ms"] = max(histogram["max_ms"], ms)
+
+@contextmanager
+def timed_phase(phase: str) -> Any:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_latency(phase, time.perf_counter() - started)
+
+def timed(fn: Any) -> Any:
+    """Tool decorator: records the call's total latency and tags the phases
+    timed inside it with the tool's name."""
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        token = _current_tool.set(fn.__name__)
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            record_latency("total", time.perf_counter() - started)
+            _current_tool.reset(token)
+    return wrapper
+
+def latency_percentile(histogram: Dict[str, Any], q: float) -> str:
+    """Upper bound of the bucket holding the q-th percentile."""
+    rank = q * histogram["count"]
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS_MS, histogram["buckets"]):
+        seen += count
+        if seen >= rank:
+            return f"<={bound}"
+    return f">{LATENCY_BUCKETS_MS[-1]}"
+
+# Helper to borrow a pooled connection to the database
+@asynccontextmanager
+async def connect(db_name: str, timeout_ms: Optional[int] = None,
+                  read_only: bool = False) -> AsyncIterator[asyncpg.Connection]:
+    pool = await route_pool(db_name, read_only)
+    started = time.perf_counter()
+    async with pool.acquire(timeout=client_timeout(timeout_ms)) as conn:
+        record_latency("pool_wait", time.perf_counter() - started)
+        await apply_timeout(conn, timeout_ms)
+        yield conn
+
+def timeout_message(timeout_ms: Optional[int]) -> str:
+    ms = STATEMENT_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    return f"Query cancelled after exceeding the {ms} ms timeout."
+
+def client_timeout(timeout_ms: Optional[int]) -> Optional[float]:
+    """Client-side deadline in seconds for a call, or None when timeouts are off."""
+    ms = STATEMENT_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    return ms / 1000 + CLIENT_TIMEOUT_GRACE if ms > 0 else None
+
+async def apply_timeout(conn: asyncpg.Connection, timeout_ms: Optional[int], local: bool = False) -> None:
+    """Override statement_timeout for this call. The pool's RESET ALL on release
+    restores the server-wide default, so nothing leaks to the next borrower."""
+    if timeout_ms is None or timeout_ms == STATEMENT_TIMEOUT_MS:
+        return
+    scope = "LOCAL " if local else ""
+    await conn.execute(f"SET {scope}statement_timeout = {max(int(timeout_ms), 0)}")
+
+async def close_pools() -> None:
+    """Close every pool, waiting for borrowed connections to be released."""
+    pools = list(_pools.items())
+    _pools.clear()
+    for (db_name, _), pool in pools:
+        await close_pool(db_name, pool)
+
+async def close_pool(db_name: str, pool: asyncpg.Pool) -> None:
+    try:
+        await asyncio.wait_for(pool.close(), timeout=10)
+    except Exception as e:
+        logger.warning(f"Pool for '{db_name}' did not close cleanly ({e}); terminating")
+        pool.terminate()
+    logger.info(f"Closed connection pool for database: {db_name}")
+
+# Literals, quoted identifiers and comments are matched as whole tokens so
+# whitespace inside them is left alone; comments are dropped.
+_SQL_TOKENS = re.compile(
+    r"([Ee]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\$((?:[A-Za-z_]\w*)?)\$.*?\$\2\$)|((?:\s|--[^\n]*|/\*.*?\*/)+)",
+    re.DOTALL
+)
+
+_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace and drop comments so formatting variants share a cache key."""
+    gaps = (match.group(3) for match in _SQL_TOKENS.finditer(query) if match.group(3))
+    if any("/*" in comment[2:] for gap in gaps for comment in _BLOCK_COMMENT.findall(gap)):
+        # PostgreSQL nests block comments, which the token pattern can't match;
+        # the normalized text is what gets executed, so leave such queries as written
+        return query.strip().rstrip(";").strip()
+    normalized = _SQL_TOKENS.sub(lambda match: match.group(1) or " ", query)
+    return normalized.strip().rstrip(";").strip()
+
+# asyncpg prepares and caches statements per connection itself
+# (statement_cache_size on the pool), keyed by the exact query text, so
+# queries are normalized before they're sent and formatting variants share a
+# plan. The statements themselves are never held here: they're bound to the
+# connection and invalid once it goes back to the pool. What is tracked is a
+# mirror of each connection's LRU of query texts, for the hit/miss counters.
+# They're an estimate: asyncpg's own introspection queries share its cache
+# without passing through here.
+_statement_caches: "weakref.WeakKeyDictionary[asyncpg.Connection, OrderedDict]" = weakref.WeakKeyDictionary()
+statement_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def raw_connection(conn: asyncpg.Connection) -> asyncpg.Connection:
+    # pool.acquire() hands out a new proxy each time; _con is the pooled connection behind it
+    return getattr(conn, "_con", conn)
+
+def cached_query(conn: asyncpg.Connection, query: str) -> str:
+    """Normalize the query and count whether asyncpg will find it in this connection's statement cache."""
+    key = normalize_query(query)
+    raw = raw_connection(conn)
+    cache = _statement_caches.get(raw)
+    if cache is None:
+        cache = _statement_caches[raw] = OrderedDict()
+    if key in cache:
+        cache.move_to_end(key)
+        statement_cache_stats["hits"] += 1
+        return key
+    statement_cache_stats["misses"] += 1
+    if len(key) > STATEMENT_CACHE_MAX_QUERY:
+        return key
+    cache[key] = None
+    if len(cache) > STATEMENT_CACHE_SIZE:
+        cache.popitem(last=False)
+        statement_cache_stats["evictions"] += 1
+    return key
+
+def forget_statement(conn: asyncpg.Connection, query: str) -> None:
+    cache = _statement_caches.get(raw_connection(conn))
+    if cache is not None:
+        cache.pop(normalize_query(query), None)
+
+async def run_prepared(conn: asyncpg.Connection, query: str, params: List[Any],
+                       timeout: Optional[float] = None) -> List[asyncpg.Record]:
+    """Fetch through the statement cache, re-preparing once if DDL invalidated the plan."""
+    with timed_phase("execute"):
+        try:
+            return await conn.fetch(cached_query(conn, query), *params, timeout=timeout)
+        except asyncpg.exceptions.InvalidCachedStatementError:
+            forget_statement(conn, query)
+            return await conn.fetch(cached_query(conn, query), *params, timeout=timeout)
+
+async def execute_prepared(conn: asyncpg.Connection, query: str, params: List[Any],
+                           timeout: Optional[float] = None) -> str:
+    """Run a parameterized write through the statement cache and return its status."""
+    with timed_phase("execute"):
+        try:
+            return await conn.execute(cached_query(conn, query), *params, timeout=timeout)
+        except asyncpg.exceptions.InvalidCachedStatementError:
+            forget_statement(conn, query)
+            return await conn.execute(cached_query(conn, query), *params, timeout=timeout)
+
+# Table references are found after these keywords; each may start a
+# comma-separated list ("FROM a x, b y").
+_TABLE_KEYWORD = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE|TABLE|TRUNCATE|ONLY)\s+", re.IGNORECASE)
+_TABLE_NAME = re.compile(r'(?:(?:"[^"]+"|[A-Za-z_][\w$]*)\.)?("[^"]+"|[A-Za-z_][\w$]*)')
+_TABLE_ALIAS = re.compile(
+    r"\s+(?:AS\s+)?(?!(?:WHERE|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|NATURAL|ON|USING|SET|VALUES|SELECT|GROUP|ORDER|"
+    r"LIMIT|OFFSET|HAVING|UNION|EXCEPT|INTERSECT|RETURNING|WINDOW|FOR|LATERAL|TABLESAMPLE|DEFAULT)\b)[A-Za-z_]\w*",
+    re.IGNORECASE
+)
+_LIST_SEPARATOR = re.compile(r"\s*,\s*")
+_DML_KEYWORD = re.compile(r"\b(?:INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+def unquote_ident(ident: str) -> str:
+    return ident[1:-1] if ident.startswith('"') else ident.lower()
+
+def table_references(query: str) -> List[Tuple[str, Optional[str]]]:
+    """Best-effort (table, alias) pairs for the tables a statement reads or writes (schema dropped)."""
+    references = []
+    for match in _TABLE_KEYWORD.finditer(query):
+        pos = match.end()
+        while True:
+            name = _TABLE_NAME.match(query, pos)
+            if not name:
+                break
+            pos = name.end()
+            alias = _TABLE_ALIAS.match(query, pos)
+            if alias:
+                pos = alias.end()
+            references.append((unquote_ident(name.group(1)), alias.group(0).split()[-1].lower() if alias else None))
+            separator = _LIST_SEPARATOR.match(query, pos)
+            if not separator:
+                break
+            pos = separator.end()
+    return references
+
+def referenced_tables(query: str) -> Set[str]:
+    """Best-effort set of table names a statement reads or writes (schema dropped)."""
+    return {table for table, _ in table_references(query)}
+
+# suggest_indexes: filter and join predicates of queries run through
+# execute_query. WHERE/ON clauses run until the next clause keyword; inside
+# them, a column compared with something is a predicate on that column.
+_PREDICATE_CLAUSE = re.compile(
+    r"\b(?:WHERE|ON)\b(.*?)(?=\b(?:GROUP|ORDER|LIMIT|OFFSET|HAVING|WINDOW|UNION|EXCEPT|INTERSECT|RETURNING|"
+    r"JOIN|INNER|LEFT|RIGHT|FULL|CROSS|FOR)\b|$)",
+    re.IGNORECASE | re.DOTALL
+)
+_PREDICATE = re.compile(
+    r'(?<![\w$."])(?:("[^"]+"|[A-Za-z_]\w*)\.)?("[^"]+"|[A-Za-z_]\w*)\s*'
+    r'(=|<>|!=|<=|>=|<|>|\bIN\b|\bBETWEEN\b|\bI?LIKE\b|\bIS\b)'
+    r'(?:\s*(?:("[^"]+"|[A-Za-z_]\w*)\.)("[^"]+"|[A-Za-z_]\w*))?',
+    re.IGNORECASE
+)
+_RANGE_OPERATORS = {"<", ">", "<=", ">=", "BETWEEN", "LIKE", "ILIKE"}
+PREDICATE_LOG_SIZE = 500
+
+# Per database: (table, equality/join columns, range column) -> uses and a sample
+# statement to EXPLAIN with hypopg. Least recently seen shapes are dropped first.
+_predicate_log: Dict[str, "OrderedDict[Tuple[str, Tuple[str, ...], Optional[str]], Dict[str, Any]]"] = {}
+
+def query_predicates(query: str) -> Dict[str, Tuple[Set[str], Optional[str]]]:
+    """Columns each table is filtered or joined on: table -> (equality and join
+    columns, first range column). Unqualified columns count for every table of
+    the query; suggest_indexes drops the ones a table doesn't have."""
+    # Blank out string literals so their contents can't look like predicates
+    query = _SQL_TOKENS.sub(lambda match: (match.group(1) if match.group(1).startswith('"') else "''")
+                            if match.group(1) else " ", query)
+    references = table_references(query)
+    aliases = {}
+    for table, alias in references:
+        aliases[alias or table] = table
+        aliases.setdefault(table, table)
+    tables = {table for table, _ in references}
+    found: Dict[str, Tuple[Set[str], Optional[str]]] = {}
+
+    def add(qualifier: Optional[str], column: str, is_range: bool) -> None:
+        owners = [aliases[unquote_ident(qualifier)]] if qualifier and unquote_ident(qualifier) in aliases else (
+            [] if qualifier else tables
+        )
+        for table in owners:
+            equality, range_column = found.get(table, (set(), None))
+            if is_range:
+                range_column = range_column or unquote_ident(column)
+            else:
+                equality.add(unquote_ident(column))
+            found[table] = (equality, range_column)
+
+    for clause in _PREDICATE_CLAUSE.finditer(query):
+        for match in _PREDICATE.finditer(clause.group(1)):
+            qualifier, column, operator_, other_qualifier, other_column = match.groups()
+            if column.upper() in ("AND", "OR", "NOT", "WHERE", "ON", "CASE", "WHEN", "THEN", "ELSE"):
+                continue
+            is_range = operator_.upper() in _RANGE_OPERATORS
+            add(qualifier, column, is_range)
+            if other_column:
+                # col = other.col: a join, both sides want an index
+                add(other_qualifier, other_column, is_range)
+    return found
+
+def record_predicates(db_name: str, query: str, params: List[Any]) -> None:
+    log = _predicate_log.setdefault(db_name, OrderedDict())
+    for table, (equality, range_column) in query_predicates(normalize_query(query)).items():
+        key = (table, tuple(sorted(equality)), range_column)
+        entry = log.get(key)
+        if entry is None:
+            entry = log[key] = {"uses": 0, "query": query, "params": list(params)}
+        entry["uses"] += 1
+        log.move_to_end(key)
+        if len(log) > PREDICATE_LOG_SIZE:
+            log.popitem(last=False)
+
+# (db, normalized query, params) -> (expires_at, tables or None, rows), oldest first.
+# A generation per database lets a write that lands while a read is in flight
+# stop that read from storing its (now stale) rows.
+_result_cache: "OrderedDict[Tuple[str, str, str], Tuple[float, Optional[Set[str]], List[asyncpg.Record]]]" = OrderedDict()
+_result_generations: Dict[str, int] = {}
+result_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def result_cache_key(db_name: str, query: str, params: List[Any]) -> Tuple[str, str, str]:
+    return (db_name, normalize_query(query), json.dumps(params, default=str))
+
+def cached_result(key: Tuple[str, str, str]) -> Optional[List[asyncpg.Record]]:
+    entry = _result_cache.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        if entry is not None:
+            del _result_cache[key]
+        result_cache_stats["misses"] += 1
+        return None
+    _result_cache.move_to_end(key)
+    result_cache_stats["hits"] += 1
+    return entry[2]
+
+def store_result(key: Tuple[str, str, str], generation: int, rows: List[asyncpg.Record]) -> None:
+    if _result_generations.get(key[0], 0) != generation:
+        return
+    tables = referenced_tables(key[1]) or None
+    _result_cache[key] = (time.monotonic() + RESULT_CACHE_TTL, tables, rows)
+    _result_cache.move_to_end(key)
+    while len(_result_cache) > RESULT_CACHE_SIZE:
+        _result_cache.popitem(last=False)
+
+def invalidate_results(db_name: str, query: str = "", written: Optional[Set[str]] = None) -> None:
+    """Drop cached reads on the tables a write touches (all of the database's if unknown)."""
+    _result_generations[db_name] = _result_generations.get(db_name, 0) + 1
+    if not _result_cache:
+        return
+    if written is None:
+        written = referenced_tables(normalize_query(query))
+    for key, (_, tables, _) in list(_result_cache.items()):
+        if key[0] != db_name:
+            continue
+        if not written or tables is None or tables & written:
+            del _result_cache[key]
+            result_cache_stats["invalidations"] += 1
+
+async def fetch_cached(conn: asyncpg.Connection, db_name: str, query: str, params: List[Any],
+                       use_cache: bool = True, timeout: Optional[float] = None) -> List[asyncpg.Record]:
+    """run_prepared, served from the result cache when it is enabled."""
+    if RESULT_CACHE_TTL <= 0 or not use_cache:
+        return await run_prepared(conn, query, params, timeout)
+    key = result_cache_key(db_name, query, params)
+    rows = cached_result(key)
+    if rows is None:
+        generation = _result_generations.get(db_name, 0)
+        rows = await run_prepared(conn, query, params, timeout)
+        store_result(key, generation, rows)
+    return rows
+
+def query_type_of(query: str) -> str:
+    return query.strip().upper().split()[0]
+
+def is_read_query(query: str) -> bool:
+    """SELECT/SHOW/EXPLAIN, or a WITH query without data-modifying CTEs."""
+    query_type = query_type_of(query)
+    return query_type in ("SELECT", "SHOW", "EXPLAIN") or (query_type == "WITH" and not _DML_KEYWORD.search(query))
+
+def replica_safe(query: str) -> bool:
+    """Reads that may run on a replica: EXPLAIN ANALYZE of a write executes the write."""
+    if not is_read_query(query):
+        return False
+    return not (query_type_of(query) == "EXPLAIN" and re.search(r"\bANALY[SZ]E\b", query, re.IGNORECASE)
+                and _DML_KEYWORD.search(query))
+
+async def run_statement(conn: asyncpg.Connection, db_name: str, query: str, params: List[Any],
+                        use_cache: bool = True,
+                        timeout: Optional[float] = None) -> Tuple[Optional[List[asyncpg.Record]], Optional[str]]:
+    """Run any statement the way execute_query does: (rows, None) for queries
+    that return rows, (None, status) for the rest."""
+    if is_read_query(query):
+        return await fetch_cached(conn, db_name, query, params, use_cache, timeout), None
+    if query_type_of(query) == "WITH":
+        # Data-modifying CTE: returns rows but must not be cached
+        rows = await run_prepared(conn, query, params, timeout)
+        invalidate_results(db_name, query)
+        return rows, None
+    if params:
+        status = await execute_prepared(conn, query, params, timeout)
+    else:
+        # For non-SELECT queries (may hold several statements, so not prepared)
+        with timed_phase("execute"):
+            status = await conn.execute(query, timeout=timeout)
+    invalidate_results(db_name, query)
+    return None, status
+
+COPY_FORMATS = ("csv", "tsv", "binary")
+
+def copy_options(fmt: str, header: bool) -> Dict[str, Any]:
+    """COPY options for an import/export file format."""
+    if fmt == "csv":
+        return {"format": "csv", "header": header}
+    if fmt == "tsv":
+        return {"format": "csv", "header": header, "delimiter": "\t"}
+    if fmt == "binary":
+        return {"format": "binary"}
+    raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(COPY_FORMATS)}")
+
+async def read_chunks(path: str) -> AsyncIterator[bytes]:
+    """Read a file in COPY_CHUNK_SIZE pieces without blocking the event loop."""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+def copy_row_count(status: str) -> int:
+    # COPY returns a "COPY <rows>" command tag
+    parts = status.split()
+    return int(parts[-1]) if parts and parts[-1].isdigit() else 0
+
+def throughput(rows: int, size: int, seconds: float) -> str:
+    seconds = max(seconds, 1e-6)
+    return (
+        f"{rows} rows, {size / 1024 / 1024:.1f} MB in {seconds:.2f}s "
+        f"({rows / seconds:,.0f} rows/s, {size / 1024 / 1024 / seconds:.1f} MB/s)"
+    )
+
+OUTPUT_FORMATS = ("text", "csv", "jsonl", "columnar-json", "arrow")
+
+# One shared encoder: json.dumps() with keyword arguments builds a new one per call
+json_value = json.JSONEncoder(default=str, separators=(",", ":")).encode
+
+def structured_columns(rows: List[asyncpg.Record]) -> List[int]:
+    """Indexes of columns holding decoded json/jsonb or arrays, judged by each
+    column's first non-NULL value (usually found in the first row)."""
+    pending, found = set(range(len(rows[0]))), []
+    for row in rows:
+        for i in list(pending):
+            if row[i] is not None:
+                pending.discard(i)
+                if isinstance(row[i], (dict, list)):
+                    found.append(i)
+        if not pending:
+            break
+    return sorted(found)
+
+def format_rows(rows: List[asyncpg.Record], fmt: str = "text", path: Optional[str] = None) -> str:
+    """Encode rows in one pass; column names are taken once from the first row."""
+    with timed_phase("serialize"):
+        return encode_rows(rows, fmt, path)
+
+def encode_rows(rows: List[asyncpg.Record], fmt: str, path: Optional[str]) -> str:
+    # arrow and columnar-json are built from the whole result; the rest are row by row
+    if fmt == "arrow":
+        return write_arrow(rows, list(rows[0].keys()), path)
+    if fmt == "columnar-json":
+        return json_value({"columns": list(rows[0].keys()), "data": [list(column) for column in zip(*rows)]})
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(OUTPUT_FORMATS)}")
+    _, header, encode = row_encoder(rows, fmt)
+    lines = map(encode, rows)
+    return "\n".join(itertools.chain([header], lines) if header is not None else lines)
+
+def row_encoder(rows: List[asyncpg.Record], fmt: str) -> Tuple[List[str], Optional[str], Callable[[asyncpg.Record], str]]:
+    """Column names, header line and per-row encoder for incremental output.
+    columnar-json rows are sized as JSON arrays; the caller assembles the columns."""
+    names = list(rows[0].keys())
+    if fmt == "text":
+        # Same output as str(dict(row)), built from precomputed keys
+        keys = [repr(name) + ": " for name in names]
+        return names, None, lambda row: "{" + ", ".join(map(operator.add, keys, map(repr, row))) + "}"
+    if fmt == "jsonl":
+        # One C-level encode per row is much faster than encoding value by value
+        return names, None, lambda row: json_value(dict(zip(names, row)))
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="")
+        structured = structured_columns(rows)
+
+        def line(values: List[Any]) -> str:
+            out.seek(0)
+            out.truncate()
+            writer.writerow(values)
+            return out.getvalue()
+
+        def encode(row: Any) -> str:
+            # Nested values go out as JSON rather than Python reprs
+            values = list(row)
+            for i in structured:
+                if values[i] is not None:
+                    values[i] = json_value(values[i])
+            return line(values)
+
+        return names, line(names), encode
+    if fmt == "columnar-json":
+        # The header only counts towards the size; the columns are built by the caller
+        return names, json_value(names), lambda row: json_value(list(row))
+    raise ValueError(f"Format '{fmt}' can't be written incrementally.")
+
+async def encode_within_budget(fetch: Callable[[int], Awaitable[List[asyncpg.Record]]], fmt: str,
+                               max_rows: int, max_bytes: int) -> Tuple[Optional[str], int, bool]:
+    """Pull rows in batches and encode them until a budget is hit. Returns the
+    output (None if there were no rows), the rows it holds and whether any were cut off."""
+    lines: List[str] = []
+    kept: List[asyncpg.Record] = []
+    names: List[str] = []
+    encode = None
+    size = count = 0
+    truncated = False
+    started, fetching = time.perf_counter(), 0.0
+    while not truncated:
+        # With a row budget, ask for one row past it to learn whether more exist
+        want = BUDGET_FETCH_SIZE if not max_rows else min(BUDGET_FETCH_SIZE, max_rows - count + 1)
+        fetch_started = time.perf_counter()
+        page = await fetch(want)
+        fetching += time.perf_counter() - fetch_started
+        if not page:
+            break
+        if encode is None:
+            names, header, encode = row_encoder(page, fmt)
+            if header is not None:
+                lines.append(header)
+                size += len(header) + 1
+        for row in page:
+            line = encode(row)
+            if (max_rows and count >= max_rows) or (max_bytes and size + len(line) + 1 > max_bytes):
+                truncated = True
+                break
+            lines.append(line)
+            size += len(line) + 1
+            count += 1
+            if fmt == "columnar-json":
+                kept.append(row)
+        if len(page) < want:
+            break
+    # Fetch time is the caller's to record (nothing to record for rows in memory)
+    record_latency("serialize", time.perf_counter() - started - fetching)
+    if encode is None:
+        return None, 0, False
+    if fmt == "columnar-json":
+        return json_value({"columns": names, "data": [list(column) for column in zip(*kept)]}), count, truncated
+    return "\n".join(lines), count, truncated
+
+def list_pages(rows: List[asyncpg.Record]) -> Callable[[int], Awaitable[List[asyncpg.Record]]]:
+    """A fetch function for encode_within_budget over rows already in memory."""
+    position = 0
+
+    async def fetch(n: int) -> List[asyncpg.Record]:
+        nonlocal position
+        page = rows[position:position + n]
+        position += n
+        return page
+
+    return fetch
+
+async def estimated_rows(conn: asyncpg.Connection, query: str, params: List[Any],
+                         timeout: Optional[float] = None) -> Optional[int]:
+    """The planner's row estimate for a query (plain EXPLAIN; nothing is executed)."""
+    try:
+        plan = await conn.fetchval("EXPLAIN (FORMAT JSON) " + query.strip().rstrip(";"), *params, timeout=timeout)
+        return int(plan[0]["Plan"]["Plan Rows"])
     except Exception as e:
-        logger.error(f"Connection error: {e}")
+        logger.info(f"Couldn't estimate result size: {e}")
+        return None
+
+def truncation_note(count: int, total: Optional[int], exact: bool, max_rows: int, max_bytes: int) -> str:
+    if total is None:
+        about = "an unknown number of"
+    else:
+        about = str(total) if exact else f"~{max(total, count + 1)}"
+    return (
+        f"[truncated: showing {count} of {about} rows (max_rows={max_rows}, max_bytes={max_bytes}); "
+        f"raise the budgets (0 = unlimited) or use stream=True]"
+    )
+
+def budgeted_output(text: Optional[str], count: int, truncated: bool, total: Optional[int], exact: bool,
+                    max_rows: int, max_bytes: int) -> str:
+    if text is None:
+        return "Query executed successfully. No results returned."
+    if not truncated:
+        return text
+    return "\n".join(part for part in (text, truncation_note(count, total, exact, max_rows, max_bytes)) if part)
+
+async def fetch_within_budget(conn: asyncpg.Connection, query: str, params: List[Any], fmt: str,
+                              max_rows: int, max_bytes: int, timeout: Optional[float] = None) -> str:
+    """Run a read query through a cursor, encoding rows as they arrive, so a
+    result far larger than the budgets is never fetched in full."""
+    executing = 0.0
+
+    async def run() -> Tuple[Optional[str], int, bool]:
+        nonlocal executing
+        async with conn.transaction():
+            started = time.perf_counter()
+            cursor = await conn.cursor(cached_query(conn, query), *params, timeout=timeout)
+            executing += time.perf_counter() - started
+
+            async def fetch(n: int) -> List[asyncpg.Record]:
+                nonlocal executing
+                started = time.perf_counter()
+                try:
+                    return await cursor.fetch(n, timeout=timeout)
+                finally:
+                    executing += time.perf_counter() - started
+
+            return await encode_within_budget(fetch, fmt, max_rows, max_bytes)
+
+    try:
+        try:
+            text, count, truncated = await run()
+        except asyncpg.exceptions.InvalidCachedStatementError:
+            forget_statement(conn, query)
+            text, count, truncated = await run()
+    finally:
+        record_latency("execute", executing)
+    total = await estimated_rows(conn, query, params, timeout) if truncated else None
+    return budgeted_output(text, count, truncated, total, False, max_rows, max_bytes)
+
+def check_format(fmt: str, path: Optional[str], stream: bool = False) -> Optional[str]:
+    """Return an error message if the requested output format can't be used."""
+    if fmt not in OUTPUT_FORMATS:
+        return f"Error: Unknown format '{fmt}'. Use one of: {', '.join(OUTPUT_FORMATS)}"
+    if fmt == "arrow" and stream:
+        return "Error: The arrow format can't be combined with stream=True."
+    if fmt == "arrow" and not path:
+        return "Error: The arrow format needs a 'path' to write the IPC file to."
+    return None
+
+def write_arrow(rows: List[asyncpg.Record], names: List[str], path: Optional[str]) -> str:
+    """Write rows to an Arrow IPC file; pyarrow is only needed for this format."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("The arrow format requires pyarrow (pip install pyarrow).")
+    arrays = []
+    for column in zip(*rows):
+        try:
+            arrays.append(pa.array(column))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Types pyarrow can't infer (uuid, inet, ...) are written as text
+            arrays.append(pa.array([
+                None if value is None else json_value(value) if isinstance(value, (dict, list)) else str(value)
+                for value in column
+            ]))
+    table = pa.Table.from_arrays(arrays, names=names)
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return f"Wrote {table.num_rows} rows to '{path}' (Arrow IPC)."
+
+# Connections pinned per (pool, "stream" or "transaction"). Counted before the
+# acquire, so concurrent callers can't all pass the limit check.
+_pinned: Dict[Tuple[asyncpg.Pool, str], int] = {}
+
+def pin(pool: asyncpg.Pool, kind: str, limit: int) -> bool:
+    key = (pool, kind)
+    if _pinned.get(key, 0) >= limit:
+        return False
+    _pinned[key] = _pinned.get(key, 0) + 1
+    return True
+
+def unpin(pool: asyncpg.Pool, kind: str) -> None:
+    key = (pool, kind)
+    _pinned[key] -= 1
+    if not _pinned[key]:
+        del _pinned[key]
+
+# Open server-side cursors, keyed by their continuation token. Each one pins a
+# pooled connection and its transaction until it is exhausted or expires.
+_cursors: Dict[str, Dict[str, Any]] = {}
+
+async def open_stream(db_name: str, query: str, page_size: int, fmt: str = "text",
+                      params: Optional[List[Any]] = None, timeout_ms: Optional[int] = None) -> str:
+    """Run a query through a server-side cursor and return its first page."""
+    timeout = client_timeout(timeout_ms)
+    pool = await route_pool(db_name, read_only=True)
+    if not pin(pool, "stream", MAX_STREAMS):
+        raise RuntimeError(
+            f"Too many open streams on '{db_name}' (limit {MAX_STREAMS}). "
+            f"Page them to the end or let them expire after {CURSOR_TTL:.0f}s, or run without stream=True."
+        )
+    try:
+        with timed_phase("pool_wait"):
+            conn = await pool.acquire(timeout=timeout)
+    except BaseException:
+        unpin(pool, "stream")
+        raise
+    tr = conn.transaction(readonly=True)
+    try:
+        await tr.start()
+        await apply_timeout(conn, timeout_ms, local=True)
+        cursor = await conn.cursor(query, *(params or []), timeout=timeout)
+        rows = await cursor.fetch(page_size, timeout=timeout)
+    except BaseException:
+        # Also runs on cancellation, so shield the cleanup from it
+        await asyncio.shield(end_stream(pool, conn, tr))
         raise
 
+    if len(rows) < page_size:
+        try:
+            await tr.commit()
+        finally:
+            await asyncio.shield(end_stream(pool, conn, tr))
+        return page_result(rows, None, fmt)
+
+    token = secrets.token_urlsafe(16)
+    _cursors[token] = {
+        "db_name": db_name,
+        "pool": pool,
+        "conn": conn,
+        "transaction": tr,
+        "cursor": cursor,
+        "format": fmt,
+        "timeout": timeout,
+        "lock": asyncio.Lock(),
+        "last_used": time.monotonic(),
+    }
+    logger.info(f"Opened streaming cursor on '{db_name}'")
+    return page_result(rows, token, fmt)
+
+async def fetch_stream(token: str, page_size: int) -> str:
+    state = _cursors.get(token)
+    if state is None:
+        return "Error: Unknown or expired continuation token."
+    async with state["lock"]:
+        if token not in _cursors:
+            return "Error: Unknown or expired continuation token."
+        try:
+            rows = await state["cursor"].fetch(page_size, timeout=state["timeout"])
+        except BaseException:
+            await asyncio.shield(close_stream(token))
+            raise
+        state["last_used"] = time.monotonic()
+        if len(rows) < page_size:
+            await close_stream(token)
+            return page_result(rows, None, state["format"])
+        return page_result(rows, token, state["format"])
+
+async def close_stream(token: str) -> None:
+    state = _cursors.pop(token, None)
+    if state is not None:
+        await end_stream(state["pool"], state["conn"], state["transaction"])
+
+async def rollback_if_open(conn: asyncpg.Connection, tr: Any) -> None:
+    """Roll back tr unless it already ended (asyncpg's Transaction has no public state)."""
+    if not conn.is_closed() and conn.is_in_transaction():
+        await tr.rollback()
+
+async def end_stream(pool: asyncpg.Pool, conn: asyncpg.Connection, tr: Any) -> None:
+    try:
+        await rollback_if_open(conn, tr)
+    except Exception as e:
+        logger.warning(f"Error closing cursor: {e}")
+    finally:
+        unpin(pool, "stream")
+        await pool.release(conn)
+
+def page_result(rows: List[asyncpg.Record], token: Any, fmt: str = "text") -> str:
+    body = format_rows(rows, fmt) if rows else "No rows."
+    if token is None:
+        return f"{body}\n[end of results]"
+    return f"{body}\n[more rows available; call fetch_more with token: {token}]"
+
+# Open transactions, keyed by handle. Like streaming cursors, each pins a
+# pooled connection until it is committed, rolled back or reaped.
+_transactions: Dict[str, Dict[str, Any]] = {}
+
+async def begin_handle(db_name: str, isolation: str, read_only: bool) -> str:
+    pool = await get_pool(db_name)
+    if not pin(pool, "transaction", MAX_TRANSACTIONS):
+        raise RuntimeError(
+            f"Too many open transactions on '{db_name}' (limit {MAX_TRANSACTIONS}). "
+            f"Commit or roll one back first; idle ones are rolled back after {TRANSACTION_TTL:.0f}s."
+        )
+    try:
+        with timed_phase("pool_wait"):
+            conn = await pool.acquire(timeout=client_timeout(None))
+    except BaseException:
+        unpin(pool, "transaction")
+        raise
+    tr = conn.transaction(isolation=isolation, readonly=read_only)
+    try:
+        await tr.start()
+    except BaseException:
+        unpin(pool, "transaction")
+        await asyncio.shield(pool.release(conn))
+        raise
+    handle = secrets.token_urlsafe(16)
+    _transactions[handle] = {
+        "db_name": db_name,
+        "pool": pool,
+        "conn": conn,
+        "transaction": tr,
+        # Tables written so far (None once a write touches unknown tables),
+        # used to invalidate cached results on commit
+        "written": set(),
+        "statements": 0,
+        "lock": asyncio.Lock(),
+        "last_used": time.monotonic(),
+    }
+    logger.info(f"Began transaction on '{db_name}'")
+    return handle
+
+async def end_handle(handle: str, commit: bool) -> Optional[str]:
+    """Commit or roll back a transaction and release its connection; returns
+    the number of statements it ran, or None if the handle is unknown."""
+    state = _transactions.pop(handle, None)
+    if state is None:
+        return None
+    try:
+        if commit:
+            await state["transaction"].commit()
+            written = state["written"]
+            if written is None or written:
+                invalidate_results(state["db_name"], written=written or set())
+    finally:
+        # Rolls back on request, and after a failed commit or an aborted statement
+        try:
+            await asyncio.shield(rollback_if_open(state["conn"], state["transaction"]))
+        except Exception as e:
+            logger.warning(f"Error rolling back transaction {handle}: {e}")
+        finally:
+            unpin(state["pool"], "transaction")
+            await asyncio.shield(state["pool"].release(state["conn"]))
+    return state["statements"]
+
+# LISTEN/NOTIFY subscriptions. LISTEN is session state, so each database gets
+# one dedicated listener connection outside the pool, shared by all of its
+# subscriptions. Notifications are buffered per subscription in a bounded ring.
+_listeners: Dict[str, asyncpg.Connection] = {}
+_listeners_lock = asyncio.Lock()
+_subscriptions: Dict[str, Dict[str, Any]] = {}
+# Strong references to in-flight log pushes so they aren't garbage collected
+_push_tasks: Set[asyncio.Task] = set()
+
+def listener_lost(db_name: str) -> None:
+    """Wake the database's pollers when its listener connection goes away."""
+    for state in _subscriptions.values():
+        if state["db_name"] == db_name:
+            state["lost"] = True
+            state["event"].set()
+
+async def listener_connection(db_name: str) -> asyncpg.Connection:
+    """Return the database's listener connection, reconnecting (and re-issuing
+    LISTEN for its subscriptions) if the previous one was lost."""
+    async with _listeners_lock:
+        conn = _listeners.get(db_name)
+        if conn is not None and not conn.is_closed():
+            return conn
+        conn = await asyncpg.connect(**connection_kwargs(db_name))
+        conn.add_termination_listener(lambda _conn: listener_lost(db_name))
+        try:
+            for state in _subscriptions.values():
+                if state["db_name"] == db_name:
+                    await conn.add_listener(state["channel"], state["callback"])
+        except BaseException:
+            await asyncio.shield(conn.close())
+            raise
+        _listeners[db_name] = conn
+        logger.info(f"Opened listener connection for database: {db_name}")
+        return conn
+
+def push_notification(state: Dict[str, Any], note: Dict[str, Any]) -> None:
+    """Forward a notification to the subscribing client as an MCP log message."""
+    session = state["session"]
+    if session is None:
+        return
+    task = asyncio.get_running_loop().create_task(session.send_log_message(
+        level="info",
+        data={"subscription": state["id"], **note},
+        logger=f"postgres-notify:{note['channel']}",
+    ))
+    _push_tasks.add(task)
+
+    def done(task: asyncio.Task) -> None:
+        _push_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # The client went away or doesn't take log messages; keep buffering only
+            logger.info(f"Stopped pushing notifications for subscription on '{state['channel']}': {task.exception()}")
+            state["session"] = None
+
+    task.add_done_callback(done)
+
+async def add_subscription(db_name: str, channel: str, session: Any) -> str:
+    conn = await listener_connection(db_name)
+    subscription_id = secrets.token_urlsafe(16)
+    state: Dict[str, Any] = {
+        "id": subscription_id,
+        "db_name": db_name,
+        "channel": channel,
+        "buffer": deque(maxlen=NOTIFY_BUFFER_SIZE),
+        "dropped": 0,
+        "event": asyncio.Event(),
+        "lost": False,
+        "session": session,
+    }
+
+    def on_notify(_conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        if len(state["buffer"]) == NOTIFY_BUFFER_SIZE:
+            state["dropped"] += 1
+        note = {"channel": channel, "pid": pid, "payload": payload, "received_at": time.time()}
+        state["buffer"].append(note)
+        state["event"].set()
+        push_notification(state, note)
+
+    state["callback"] = on_notify
+    await conn.add_listener(channel, on_notify)
+    _subscriptions[subscription_id] = state
+    logger.info(f"Subscribed to channel '{channel}' on '{db_name}'")
+    return subscription_id
+
+async def remove_subscription(subscription_id: str) -> bool:
+    """Stop listening for a subscription; the database's listener connection
+    is closed once its last subscription is gone."""
+    state = _subscriptions.pop(subscription_id, None)
+    if state is None:
+        return False
+    db_name = state["db_name"]
+    async with _listeners_lock:
+        conn = _listeners.get(db_name)
+        if conn is None or conn.is_closed():
+            _listeners.pop(db_name, None)
+        elif any(other["db_name"] == db_name for other in _subscriptions.values()):
+            await conn.remove_listener(state["channel"], state["callback"])
+        else:
+            del _listeners[db_name]
+            await asyncio.shield(conn.close())
+            logger.info(f"Closed listener connection for database: {db_name}")
+    return True
+
+def format_notifications(notes: List[Dict[str, Any]]) -> str:
+    lines = []
+    for note in notes:
+        received = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(note["received_at"]))
+        lines.append(f"[{received}Z] {note['channel']} (pid {note['pid']}): {note['payload']}")
+    return "\n".join(lines)
+
+async def reap_idle_cursors() -> None:
+    while True:
+        await asyncio.sleep(min(CURSOR_TTL, TRANSACTION_TTL, 30))
+        now = time.monotonic()
+        for token, state in list(_cursors.items()):
+            if now - state["last_used"] > CURSOR_TTL and not state["lock"].locked():
+                logger.info(f"Closing idle streaming cursor on '{state['db_name']}'")
+                await close_stream(token)
+        for handle, state in list(_transactions.items()):
+            if now - state["last_used"] > TRANSACTION_TTL and not state["lock"].locked():
+                logger.info(f"Rolling back idle transaction on '{state['db_name']}'")
+                try:
+                    await end_handle(handle, commit=False)
+                except Exception as e:
+                    logger.warning(f"Error rolling back idle transaction: {e}")
+
+# Catalog metadata cached per database. Entries are kept until the catalog
+# fingerprint changes: any DDL inserts, updates or deletes rows in pg_class,
+# pg_attribute or pg_namespace, which changes the row count or the sum of the
+# rows' xmins. A sum keeps moving after XID wraparound, where a max would not.
+# Only user relations are fingerprinted; their pg_attribute rows are found
+# through the attrelid index rather than by scanning the whole catalog.
+_catalog_cache: Dict[str, Dict[str, Any]] = {}
+
+CATALOG_FINGERPRINT_SQL = """
+WITH rels AS (
+    SELECT c.oid, c.xmin::text::bigint AS xmin
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+     WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+       AND n.nspname NOT LIKE 'pg\\_toast%'
+       AND n.nspname NOT LIKE 'pg\\_temp\\_%'
+)
+SELECT (SELECT count(*) || ':' || coalesce(sum(xmin), 0) FROM rels)
+    || ':' || (SELECT count(*) || ':' || coalesce(sum(a.xmin::text::bigint), 0)
+                 FROM rels JOIN pg_attribute a ON a.attrelid = rels.oid)
+    || ':' || (SELECT count(*) || ':' || sum(xmin::text::bigint) FROM pg_namespace);
+"""
+
+async def catalog_entry(conn: asyncpg.Connection, db_name: str) -> Dict[str, Any]:
+    """Return the cache entry for a database, dropping it if the schema changed."""
+    fingerprint = await conn.fetchval(CATALOG_FINGERPRINT_SQL)
+    entry = _catalog_cache.get(db_name)
+    if entry is None or entry["fingerprint"] != fingerprint:
+        if entry is not None:
+            logger.info(f"Catalog changed in '{db_name}'; clearing cached metadata")
+        entry = {"fingerprint": fingerprint, "tables": None, "columns": {}, "describe": {}, "keys": {}}
+        _catalog_cache[db_name] = entry
+    return entry
+
+# Every user relation with its columns, primary key and indexes, in one round
+# trip. This is cached with the catalog; row estimates are not, since ANALYZE
+# and VACUUM update reltuples in place without moving the fingerprint.
+DESCRIBE_DATABASE_SQL = """
+SELECT c.oid AS relid,
+       n.nspname AS schema_name,
+       c.relname AS table_name,
+       c.relkind,
+       (SELECT json_agg(json_build_object(
+                   'name', a.attname,
+                   'type', format_type(a.atttypid, a.atttypmod),
+                   'nullable', NOT a.attnotnull) ORDER BY a.attnum)
+          FROM pg_attribute a
+         WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped) AS columns,
+       (SELECT json_agg(a.attname ORDER BY k.ord)
+          FROM pg_index i
+         CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+          JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+         WHERE i.indrelid = c.oid AND i.indisprimary) AS primary_key,
+       (SELECT json_agg(pg_get_indexdef(i.indexrelid) ORDER BY i.indexrelid)
+          FROM pg_index i
+         WHERE i.indrelid = c.oid) AS indexes
+  FROM pg_class c
+  JOIN pg_namespace n ON n.oid = c.relnamespace
+ WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+   AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+   AND n.nspname NOT LIKE 'pg\\_toast%'
+   AND n.nspname NOT LIKE 'pg\\_temp\\_%'
+   AND ($1::text IS NULL OR n.nspname = $1)
+ ORDER BY n.nspname, c.relname;
+"""
+
+# Planner row estimates, fetched fresh on each call. reltuples is -1 for tables never analyzed.
+ROW_ESTIMATES_SQL = "SELECT oid, reltuples::bigint AS estimated_rows FROM pg_class WHERE oid = ANY($1::oid[]);"
+
+RELKIND_NAMES = {"r": "table", "p": "partitioned table", "v": "view", "m": "materialized view", "f": "foreign table"}
+
+def format_description(rows: List[asyncpg.Record], estimates: Dict[int, int]) -> str:
+    blocks = []
+    for row in rows:
+        estimate = estimates.get(row["relid"])
+        size = f"~{estimate} rows" if estimate is not None and estimate >= 0 else "row count unknown"
+        lines = [f"{row['schema_name']}.{row['table_name']} ({RELKIND_NAMES.get(row['relkind'], row['relkind'])}, {size})"]
+        primary_key = row["primary_key"] or []
+        if primary_key:
+            lines.append(f"  primary key: {', '.join(primary_key)}")
+        for column in row["columns"] or []:
+            null = "" if column["nullable"] else " NOT NULL"
+            lines.append(f"  {column['name']}: {column['type']}{null}")
+        for index in row["indexes"] or []:
+            lines.append(f"  index: {index}")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+def plan_nodes(plan: Dict[str, Any], depth: int = 0) -> List[Dict[str, Any]]:
+    """Flatten an EXPLAIN (FORMAT JSON) plan, adding self time and self buffer reads to each node."""
+    children = plan.get("Plans", [])
+    loops = plan.get("Actual Loops", 1) or 0
+    total_ms = plan.get("Actual Total Time", 0.0) * loops
+    child_ms = sum(child.get("Actual Total Time", 0.0) * (child.get("Actual Loops", 1) or 0) for child in children)
+    child_reads = sum(child.get("Shared Read Blocks", 0) for child in children)
+    node = {
+        "depth": depth,
+        "type": plan.get("Node Type", "?"),
+        "relation": plan.get("Relation Name"),
+        "index": plan.get("Index Name"),
+        "self_ms": max(total_ms - child_ms, 0.0),
+        "total_ms": total_ms,
+        "actual_rows": plan.get("Actual Rows", 0) * loops,
+        "plan_rows": plan.get("Plan Rows", 0) * max(loops, 1),
+        "self_reads": max(plan.get("Shared Read Blocks", 0) - child_reads, 0),
+        "removed_by_filter": plan.get("Rows Removed by Filter", 0) * loops,
+        "never_executed": loops == 0,
+    }
+    nodes = [node]
+    for child in children:
+        nodes.extend(plan_nodes(child, depth + 1))
+    return nodes
+
+def describe_node(node: Dict[str, Any]) -> str:
+    name = node["type"]
+    if node["relation"]:
+        name += f" on {node['relation']}"
+    if node["index"]:
+        name += f" using {node['index']}"
+    return name
+
+def estimate_miss(node: Dict[str, Any]) -> float:
+    actual, planned = max(node["actual_rows"], 1), max(node["plan_rows"], 1)
+    return max(actual / planned, planned / actual)
+
+def summarize_profile(explain: Dict[str, Any], table_rows: Dict[str, int]) -> str:
+    plan = explain["Plan"]
+    nodes = plan_nodes(plan)
+    executed = [node for node in nodes if not node["never_executed"]]
+    lines = [
+        f"Planning: {explain.get('Planning Time', 0):.2f} ms, execution: {explain.get('Execution Time', 0):.2f} ms, "
+        f"{len(nodes)} plan nodes"
+    ]
+
+    lines.append("\nTop nodes by self time:")
+    for node in sorted(executed, key=lambda n: n["self_ms"], reverse=True)[:PROFILE_TOP_NODES]:
+        lines.append(f"  {node['self_ms']:.2f} ms  {describe_node(node)} (rows {node['actual_rows']})")
+
+    misses = [node for node in executed if estimate_miss(node) >= 10]
+    lines.append("\nRow estimate misses (10x or worse):")
+    for node in sorted(misses, key=estimate_miss, reverse=True)[:PROFILE_TOP_NODES]:
+        lines.append(
+            f"  {estimate_miss(node):.0f}x  {describe_node(node)}: planned {node['plan_rows']}, actual {node['actual_rows']}"
+        )
+    if not misses:
+        lines.append("  none")
+
+    seq_scans = [
+        node for node in executed
+        if node["type"] == "Seq Scan" and table_rows.get(node["relation"], 0) >= PROFILE_LARGE_TABLE_ROWS
+    ]
+    lines.append(f"\nSequential scans on large tables (>= {PROFILE_LARGE_TABLE_ROWS} rows):")
+    for node in seq_scans:
+        lines.append(
+            f"  {node['relation']} (~{table_rows[node['relation']]} rows): returned {node['actual_rows']}, "
+            f"removed by filter {node['removed_by_filter']}, {node['self_ms']:.2f} ms"
+        )
+    if not seq_scans:
+        lines.append("  none")
+
+    hits, reads = plan.get("Shared Hit Blocks", 0), plan.get("Shared Read Blocks", 0)
+    ratio = f"{hits / (hits + reads):.1%}" if hits + reads else "n/a"
+    lines.append(
+        f"\nBuffers: shared hit {hits}, read {reads} (hit ratio {ratio}), dirtied {plan.get('Shared Dirtied Blocks', 0)}, "
+        f"written {plan.get('Shared Written Blocks', 0)}, temp read {plan.get('Temp Read Blocks', 0)}, "
+        f"temp written {plan.get('Temp Written Blocks', 0)}"
+    )
+    for node in sorted(executed, key=lambda n: n["self_reads"], reverse=True)[:PROFILE_TOP_NODES]:
+        if node["self_reads"]:
+            lines.append(f"  {node['self_reads']} blocks read by {describe_node(node)}")
+    return "\n".join(lines)
+
+# Column types and nullability, plus each column's position in the primary key
+# (NULL if not part of it)
+TABLE_KEYS_SQL = """
+SELECT a.attname,
+       format_type(a.atttypid, a.atttypmod) AS type,
+       a.attnotnull,
+       array_position(i.indkey::int2[], a.attnum) AS pk_position
+  FROM pg_attribute a
+  JOIN pg_class c ON c.oid = a.attrelid
+  JOIN pg_namespace n ON n.oid = c.relnamespace
+  LEFT JOIN pg_index i ON i.indrelid = c.oid AND i.indisprimary
+ WHERE n.nspname = $1 AND c.relname = $2 AND a.attnum > 0 AND NOT a.attisdropped
+ ORDER BY a.attnum;
+"""
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def encode_page_cursor(values: List[Any]) -> str:
+    raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_page_cursor(cursor: str) -> List[Any]:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    values = json.loads(raw)
+    if not isinstance(values, list):
+        raise ValueError("Invalid page cursor.")
+    return values
+
+async def table_keys(conn: asyncpg.Connection, db_name: str, schema: str, table: str) -> Dict[str, Any]:
+    """Column types and primary key of a table, cached with the catalog fingerprint."""
+    entry = await catalog_entry(conn, db_name)
+    keys = entry["keys"].get((schema, table))
+    if keys is None:
+        rows = await conn.fetch(TABLE_KEYS_SQL, schema, table)
+        keys = {
+            "types": {row["attname"]: row["type"] for row in rows},
+            "not_null": {row["attname"] for row in rows if row["attnotnull"]},
+            "primary_key": [row["attname"] for row in sorted(
+                (row for row in rows if row["pk_position"]), key=lambda row: row["pk_position"]
+            )],
+        }
+        entry["keys"][(schema, table)] = keys
+    return keys
+
+def cursor_param(value: Any, type_name: str) -> str:
+    # Cursor values travel as text and are cast back to the key's type in SQL
+    if type_name in ("json", "jsonb"):
+        return json.dumps(value)
+    return str(value)
+
+def keyset_query(schema: str, table: str, keys: Dict[str, Any], columns: Optional[List[str]],
+                 order_by: Optional[List[str]], descending: bool, page_size: int,
+                 after: Optional[str]) -> Tuple[str, List[Any], List[str]]:
+    """Build one page of a keyset-paginated SELECT: (query, params, sort key columns)."""
+    types = keys["types"]
+    if not types:
+        raise ValueError(f"Table '{schema}.{table}' not found.")
+    sort_keys = list(order_by or keys["primary_key"])
+    # Append the primary key as a tiebreaker so keys are unique and no row is skipped
+    sort_keys += [key for key in keys["primary_key"] if key not in sort_keys]
+    for name in (columns or []) + sort_keys:
+        if name not in types:
+            raise ValueError(f"Column '{name}' not found in '{schema}.{table}'.")
+    for name in sort_keys:
+        # Their decoded values have no text form that casts back to the type
+        if types[name].endswith("[]") or types[name] == "bytea":
+            raise ValueError(f"Column '{name}' ({types[name]}) can't be used in order_by.")
+
+    selected = list(columns) if columns else None
+    if selected is not None:
+        # The cursor is built from the sort keys, so they're always returned
+        selected += [key for key in sort_keys if key not in selected]
+    projection = ", ".join(quote_ident(name) for name in selected) if selected else "*"
+    query = f"SELECT {projection} FROM {quote_ident(schema)}.{quote_ident(table)}"
+
+    params: List[Any] = []
+    if after:
+        if not sort_keys:
+            raise ValueError("The 'after' cursor needs order_by or a primary key.")
+        values = decode_page_cursor(after)
+        if len(values) != len(sort_keys):
+            raise ValueError("The 'after' cursor doesn't match order_by.")
+        comparison = "<" if descending else ">"
+        if None not in values and all(key in keys["not_null"] for key in sort_keys):
+            params = [cursor_param(value, types[key]) for key, value in zip(sort_keys, values)]
+            placeholders = ", ".join(f"${i}::text::{types[key]}" for i, key in enumerate(sort_keys, 1))
+            query += f" WHERE ({', '.join(quote_ident(key) for key in sort_keys)}) {comparison} ({placeholders})"
+        else:
+            # A row comparison is NULL when any side is, so spell it out key by
+            # key, with NULLs sorting last ascending and first descending as in ORDER BY
+            terms: List[str] = []
+            equal: List[str] = []
+            for key, value in zip(sort_keys, values):
+                column = quote_ident(key)
+                if value is None:
+                    later = f"{column} IS NOT NULL" if descending else None
+                    equal_term = f"{column} IS NULL"
+                else:
+                    params.append(cursor_param(value, types[key]))
+                    placeholder = f"${len(params)}::text::{types[key]}"
+                    later = f"{column} {comparison} {placeholder}"
+                    if not descending and key not in keys["not_null"]:
+                        later = f"({later} OR {column} IS NULL)"
+                    equal_term = f"{column} = {placeholder}"
+                if later:
+                    terms.append(" AND ".join(equal + [later]))
+                equal.append(equal_term)
+            query += " WHERE " + (" OR ".join(f"({term})" for term in terms) if terms else "false")
+    if sort_keys:
+        direction = " DESC" if descending else ""
+        query += " ORDER BY " + ", ".join(quote_ident(key) + direction for key in sort_keys)
+    # One extra row tells us whether another page exists
+    query += f" LIMIT {page_size + 1}"
+    return query, params, sort_keys
+
+# Planner estimates, on-disk sizes and activity counters; nothing here scans the table
+TABLE_STATS_SQL = """
+SELECT n.nspname AS schema_name,
+       c.relname AS table_name,
+       c.reltuples::bigint AS estimated_rows,
+       c.relpages,
+       pg_size_pretty(pg_table_size(c.oid)) AS table_size,
+       pg_size_pretty(pg_indexes_size(c.oid)) AS index_size,
+       pg_size_pretty(pg_total_relation_size(c.oid)) AS total_size,
+       s.seq_scan, s.seq_tup_read, s.idx_scan, s.idx_tup_fetch,
+       s.n_tup_ins, s.n_tup_upd, s.n_tup_del, s.n_live_tup, s.n_dead_tup,
+       greatest(s.last_vacuum, s.last_autovacuum) AS last_vacuum,
+       greatest(s.last_analyze, s.last_autoanalyze) AS last_analyze
+  FROM pg_class c
+  JOIN pg_namespace n ON n.oid = c.relnamespace
+  LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+ WHERE n.nspname = $1
+   AND ($2::text IS NULL OR c.relname = $2)
+   AND c.relkind IN ('r', 'p', 'm')
+ ORDER BY pg_total_relation_size(c.oid) DESC;
+"""
+
+def format_table_stats(row: asyncpg.Record) -> str:
+    estimate = row["estimated_rows"]
+    lines = [
+        f"{row['schema_name']}.{row['table_name']}",
+        f"  estimated rows: {estimate if estimate >= 0 else 'unknown (never analyzed)'}, pages: {row['relpages']}",
+        f"  size: table {row['table_size']}, indexes {row['index_size']}, total {row['total_size']}",
+    ]
+    if row["seq_scan"] is not None:
+        lines += [
+            f"  scans: seq {row['seq_scan']} ({row['seq_tup_read']} rows read), index {row['idx_scan'] or 0} ({row['idx_tup_fetch'] or 0} rows fetched)",
+            f"  writes: {row['n_tup_ins']} inserted, {row['n_tup_upd']} updated, {row['n_tup_del']} deleted",
+            f"  live rows: {row['n_live_tup']}, dead rows: {row['n_dead_tup']}",
+            f"  last vacuum: {row['last_vacuum'] or 'never'}, last analyze: {row['last_analyze'] or 'never'}",
+        ]
+    return "\n".join(lines)
+
+# suggest_indexes: scan counters, existing index keys and the columns of the
+# tables seen in the predicate log
+INDEX_SCAN_STATS_SQL = """
+SELECT relname AS table_name, seq_scan, seq_tup_read, coalesce(idx_scan, 0) AS idx_scan, n_live_tup
+  FROM pg_stat_user_tables
+ WHERE schemaname = $1;
+"""
+
+INDEX_KEYS_SQL = """
+SELECT c.relname AS table_name, array_agg(a.attname::text ORDER BY k.ord) AS columns
+  FROM pg_index i
+  JOIN pg_class c ON c.oid = i.indrelid
+  JOIN pg_namespace n ON n.oid = c.relnamespace
+ CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+  JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+ WHERE n.nspname = $1
+ GROUP BY c.relname, i.indexrelid;
+"""
+
+TABLE_COLUMNS_SQL = """
+SELECT c.relname AS table_name, array_agg(a.attname::text) AS columns
+  FROM pg_class c
+  JOIN pg_namespace n ON n.oid = c.relnamespace
+  JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+ WHERE n.nspname = $1 AND c.relname = ANY($2::text[])
+ GROUP BY c.relname;
+"""
+
+def index_covered(columns: List[str], equality: int, indexes: List[List[str]]) -> bool:
+    """Whether an existing index already leads with the candidate's equality
+    columns (in any order) followed by its range column."""
+    for index in indexes:
+        if len(index) >= len(columns) and set(index[:equality]) == set(columns[:equality]) \
+                and index[equality:len(columns)] == columns[equality:]:
+            return True
+    return False
+
+def index_candidates(log: Dict[Tuple[str, Tuple[str, ...], Optional[str]], Dict[str, Any]],
+                     stats: Dict[str, asyncpg.Record], columns: Dict[str, Set[str]],
+                     indexes: Dict[str, List[List[str]]]) -> List[Dict[str, Any]]:
+    """Turn logged predicate shapes into index candidates, ranked by uses x live
+    rows x the share of the table's scans that are sequential."""
+    # Equality columns used most often across a table's queries go first
+    frequency: Dict[Tuple[str, str], int] = {}
+    for (table, equality, _), entry in log.items():
+        for column in equality:
+            frequency[(table, column)] = frequency.get((table, column), 0) + entry["uses"]
+    candidates: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+    for (table, equality, range_column), entry in log.items():
+        stat = stats.get(table)
+        if stat is None or table not in columns or (stat["n_live_tup"] or 0) < INDEX_MIN_ROWS:
+            continue
+        known = columns[table]
+        ordered = sorted((column for column in equality if column in known),
+                         key=lambda column: (-frequency[(table, column)], column))
+        if range_column is not None and range_column not in known:
+            range_column = None
+        key_columns = ordered + ([range_column] if range_column else [])
+        if not key_columns or index_covered(key_columns, len(ordered), indexes.get(table, [])):
+            continue
+        candidate = candidates.get((table, tuple(key_columns)))
+        if candidate is None:
+            candidate = candidates[(table, tuple(key_columns))] = {
+                "table": table, "columns": key_columns, "equality": ordered, "range": range_column,
+                "uses": 0, "sample": entry, "stat": stat,
+            }
+        candidate["uses"] += entry["uses"]
+        if entry["uses"] > candidate["sample"]["uses"]:
+            candidate["sample"] = entry
+    for candidate in candidates.values():
+        stat = candidate["stat"]
+        scans = (stat["seq_scan"] or 0) + stat["idx_scan"]
+        seq_share = (stat["seq_scan"] or 0) / scans if scans else 1.0
+        candidate["benefit"] = candidate["uses"] * stat["n_live_tup"] * seq_share
+    return sorted(candidates.values(), key=lambda candidate: -candidate["benefit"])
+
+async def hypothetical_costs(conn: asyncpg.Connection, definition: str,
+                             sample: Dict[str, Any]) -> Tuple[float, float, bool]:
+    """Planner cost of a logged statement without and with a hypopg index, and
+    whether the plan used it. Plain EXPLAIN: the statement isn't executed."""
+    explain = "EXPLAIN (FORMAT JSON) " + sample["query"].strip().rstrip(";")
+    before = (await conn.fetchval(explain, *sample["params"]))[0]["Plan"]["Total Cost"]
+    name = await conn.fetchval("SELECT indexname FROM hypopg_create_index($1)", definition)
+    try:
+        plan = (await conn.fetchval(explain, *sample["params"]))[0]["Plan"]
+    finally:
+        await conn.execute("SELECT hypopg_reset()")
+    used = any(node["index"] == name for node in plan_nodes(plan))
+    return before, plan["Total Cost"], used
+
+def format_scan_stats(stat: asyncpg.Record) -> str:
+    return (
+        f"~{stat['n_live_tup']} live rows, {stat['seq_scan'] or 0} sequential vs {stat['idx_scan']} index scans, "
+        f"{stat['seq_tup_read'] or 0} rows read sequentially"
+    )
+
+@asynccontextmanager
+async def lifespan(server: FastMCP) -> AsyncIterator[Dict[str, Any]]:
+    reaper = asyncio.create_task(reap_idle_cursors())
+    monitor = asyncio.create_task(monitor_replicas()) if _replicas else None
+    try:
+        yield {}
+    finally:
+        reaper.cancel()
+        if monitor is not None:
+            monitor.cancel()
+        for token in list(_cursors):
+            await close_stream(token)
+        for handle in list(_transactions):
+            try:
+                await end_handle(handle, commit=False)
+            except Exception as e:
+                logger.warning(f"Error rolling back transaction on shutdown: {e}")
+        _subscriptions.clear()
+        for db_name, conn in list(_listeners.items()):
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning(f"Error closing listener connection for '{db_name}': {e}")
+        _listeners.clear()
+        await close_pools()
+
+# Initialize FastMCP
+mcp = FastMCP("Postgres Explorer", lifespan=lifespan)
+
+async def database_names() -> List[str]:
+    async with connect("postgres") as conn:
+        rows = await conn.fetch("SELECT datname FROM pg_database WHERE datistemplate = false;")
+    return [row["datname"] for row in rows]
+
 @mcp.tool(name="list_databases", description="List all PostgreSQL databases")
+@timed
 async def list_databases() -> str:
     """List all available PostgreSQL databases."""
     try:
-        conn = await connect("postgres")
-        rows = await conn.fetch("SELECT datname FROM pg_database WHERE datistemplate = false;")
-        await conn.close()
-        return "\n".join(row["datname"] for row in rows) if rows else "No databases found."
+        names = await database_names()
+        return "\n".join(names) if names else "No databases found."
     except Exception as e:
         logger.error(f"Error listing databases: {e}")
         return f"Error: {str(e)}"
 
 @mcp.tool(name="list_tables", description="List all public tables in a PostgreSQL database")
+@timed
 async def list_tables(db_name: str) -> str:
     """List all tables in the specified database."""
     try:
-        conn = await connect(db_name)
-        rows = await conn.fetch("SELECT table_name FROM information_schema.tables WHERE table_schema='public';")
-        await conn.close()
-        return "\n".join(row["table_name"] for row in rows) if rows else f"No public tables found in '{db_name}'."
+        async with connect(db_name) as conn:
+            entry = await catalog_entry(conn, db_name)
+            if entry["tables"] is None:
+                rows = await conn.fetch("SELECT table_name FROM information_schema.tables WHERE table_schema='public';")
+                entry["tables"] = [row["table_name"] for row in rows]
+        tables = entry["tables"]
+        return "\n".join(tables) if tables else f"No public tables found in '{db_name}'."
     except Exception as e:
         logger.error(f"Error listing tables: {e}")
         return f"Error: {str(e)}"
 
 @mcp.tool(name="table_schema", description="Get column names and types of a table")
-async def table_schema(db_name: str, table: str) -> str:
+@timed
+async def table_schema(db_name: str, table: str, schema: str = "public") -> str:
     """Get schema information for a specific table."""
     try:
-        conn = await connect(db_name)
-        rows = await conn.fetch(
-            "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = $1;",
-            table
-        )
-        await conn.close()
-        return "\n".join(f"{row['column_name']}: {row['data_type']}" for row in rows) if rows else f"No schema found for table '{table}'."
+        async with connect(db_name) as conn:
+            entry = await catalog_entry(conn, db_name)
+            columns = entry["columns"].get((schema, table))
+            if columns is None:
+                rows = await conn.fetch(
+                    "SELECT column_name, data_type FROM information_schema.columns "
+                    "WHERE table_schema = $1 AND table_name = $2 ORDER BY ordinal_position;",
+                    schema, table
+                )
+                columns = [(row["column_name"], row["data_type"]) for row in rows]
+                entry["columns"][(schema, table)] = columns
+        return "\n".join(f"{name}: {dtype}" for name, dtype in columns) if columns else f"No schema found for table '{schema}.{table}'."
     except Exception as e:
         logger.error(f"Error retrieving schema: {e}")
         return f"Error: {str(e)}"
 
-@mcp.tool(name="view_table", description="Show first 10 rows of a table")
-async def view_table(db_name: str, table: str) -> str:
-    """View the first 10 rows of a table."""
+@mcp.tool(name="describe_database", description="Describe every table in a database (columns, types, nullability, primary keys, indexes, estimated rows) in one call")
+@timed
+async def describe_database(db_name: str, schema: str = None) -> str:
+    """Describe all user tables, optionally limited to one schema."""
     try:
-        conn = await connect(db_name)
-        # Use proper identifier quoting
-        rows = await conn.fetch(f'SELECT * FROM "{table}" LIMIT 10;')
-        await conn.close()
+        async with connect(db_name) as conn:
+            entry = await catalog_entry(conn, db_name)
+            rows = entry["describe"].get(schema)
+            if rows is None:
+                rows = entry["describe"][schema] = await conn.fetch(DESCRIBE_DATABASE_SQL, schema)
+            if not rows:
+                return f"No tables found in '{db_name}'."
+            estimates = {
+                row["oid"]: row["estimated_rows"]
+                for row in await conn.fetch(ROW_ESTIMATES_SQL, [row["relid"] for row in rows])
+            }
+        return format_description(rows, estimates)
+    except Exception as e:
+        logger.error(f"Error describing database: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="view_table", description="Show rows of a table, one page at a time (default 10). Pages are ordered by order_by (default: primary key); pass the returned 'after' cursor to get the next page. format: text, csv, jsonl, columnar-json or arrow (written to path)")
+@timed
+async def view_table(db_name: str, table: str, schema: str = "public", columns: Optional[List[str]] = None,
+                     order_by: Optional[List[str]] = None, descending: bool = False, page_size: int = 10,
+                     after: Optional[str] = None, format: str = "text", path: Optional[str] = None,
+                     use_cache: bool = True, timeout_ms: Optional[int] = None) -> str:
+    """View a page of a table using keyset pagination."""
+    error = check_format(format, path)
+    if error:
+        return error
+    page_size = max(page_size, 1)
+    try:
+        async with connect(db_name, timeout_ms, read_only=True) as conn:
+            keys = await table_keys(conn, db_name, schema, table)
+            query, params, sort_keys = keyset_query(
+                schema, table, keys, columns, order_by, descending, page_size, after
+            )
+            rows = await fetch_cached(conn, db_name, query, params, use_cache, client_timeout(timeout_ms))
         
         if not rows:
             return f"No rows found in '{table}'."
         
+        next_cursor = None
+        more = len(rows) > page_size
+        if more:
+            rows = rows[:page_size]
+            if sort_keys:
+                next_cursor = encode_page_cursor([rows[-1][key] for key in sort_keys])
+        
         # Format results nicely
-        result_lines = []
-        for row in rows:
-            row_dict = dict(row)
-            result_lines.append(str(row_dict))
-            
-        return "\n".join(result_lines)
+        result = format_rows(rows, format, path)
+        if next_cursor:
+            result += f"\n[more rows available; next page: after={next_cursor}]"
+        elif more:
+            result += f"\n[more rows available; '{table}' has no primary key, so pass order_by to page through it]"
+        if sort_keys and not keys["primary_key"] and (more or after):
+            result += (
+                f"\n[warning: '{table}' has no primary key, so pages are ordered by order_by alone and rows "
+                f"sharing its values at a page boundary are skipped; order by columns that are unique together]"
+            )
+        return result
+    except asyncio.TimeoutError:
+        return f"Error: {timeout_message(timeout_ms)}"
     except Exception as e:
         logger.error(f"Error viewing table '{table}': {e}")
         return f"Error: {str(e)}"
 
-@mcp.tool(name="execute_query", description="Execute a custom SQL query")
-async def execute_query(db_name: str, query: str) -> str:
+@mcp.tool(name="table_stats", description="Estimated row count, size and activity counters for a table (or every table in a schema) without scanning it")
+@timed
+async def table_stats(db_name: str, table: Optional[str] = None, schema: str = "public") -> str:
+    """Report pg_class estimates, sizes and pg_stat_user_tables counters."""
+    try:
+        async with connect(db_name) as conn:
+            rows = await conn.fetch(TABLE_STATS_SQL, schema, table)
+        if not rows:
+            return f"No table '{schema}.{table}' found." if table else f"No tables found in schema '{schema}'."
+        return "\n\n".join(format_table_stats(row) for row in rows)
+    except Exception as e:
+        logger.error(f"Error reading table stats: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="sample_table", description="Return a quick random sample of a table's rows using TABLESAMPLE SYSTEM (block sampling, constant time on large tables)")
+@timed
+async def sample_table(db_name: str, table: str, schema: str = "public", rows: int = 10,
+                       seed: Optional[float] = None, format: str = "text", path: Optional[str] = None,
+                       timeout_ms: Optional[int] = None) -> str:
+    """Sample roughly `rows` rows by reading a few random pages."""
+    error = check_format(format, path)
+    if error:
+        return error
+    rows = max(rows, 1)
+    try:
+        async with connect(db_name, timeout_ms, read_only=True) as conn:
+            stats = await conn.fetchrow(
+                "SELECT c.reltuples, c.relpages FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE n.nspname = $1 AND c.relname = $2;",
+                schema, table
+            )
+            if stats is None:
+                return f"Error: Table '{schema}.{table}' not found."
+            estimate, pages = stats["reltuples"], stats["relpages"]
+            # SYSTEM picks whole pages, so size the percentage in pages: enough for
+            # twice the rows wanted, and never fewer than SAMPLE_MIN_PAGES. With no
+            # statistics sample everything and let LIMIT stop the scan early.
+            if estimate > 0 and pages > 0:
+                wanted = max(math.ceil(rows * 2 * pages / estimate), SAMPLE_MIN_PAGES)
+                percent = min(100.0, wanted * 100.0 / pages)
+            else:
+                percent = 100.0
+            query = (
+                f"SELECT * FROM {quote_ident(schema)}.{quote_ident(table)} "
+                f"TABLESAMPLE SYSTEM ($1::real)"
+                + (" REPEATABLE ($3::double precision)" if seed is not None else "")
+                + " LIMIT $2"
+            )
+            while True:
+                params = [percent, rows] + ([seed] if seed is not None else [])
+                sample = await run_prepared(conn, query, params, client_timeout(timeout_ms))
+                # Pages vary in how many live rows they hold; widen a short sample
+                if len(sample) >= rows or percent >= 100.0:
+                    break
+                percent = min(100.0, percent * 4)
+        if not sample:
+            return f"No rows sampled from '{table}'."
+        return format_rows(sample, format, path)
+    except asyncio.TimeoutError:
+        return f"Error: {timeout_message(timeout_ms)}"
+    except Exception as e:
+        logger.error(f"Error sampling table '{table}': {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="execute_query", description="Execute a custom SQL query. Use $1, $2, ... placeholders with params to reuse one cached plan. Set stream=True to page through large SELECT results with fetch_more. format: text, csv, jsonl, columnar-json or arrow (written to path). timeout_ms overrides the server's statement timeout. Results stop at max_rows rows or max_bytes characters (server defaults; 0 = unlimited) and end with a [truncated: ...] line when cut off")
+@timed
+async def execute_query(db_name: str, query: str, params: Optional[List[Any]] = None, stream: bool = False,
+                        page_size: int = STREAM_PAGE_SIZE, format: str = "text", path: Optional[str] = None,
+                        use_cache: bool = True, timeout_ms: Optional[int] = None,
+                        max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> str:
     """Execute a custom SQL query and return results."""
+    error = check_format(format, path, stream)
+    if error:
+        return error
+    params = params or []
+    max_rows = MAX_ROWS if max_rows is None else max(max_rows, 0)
+    max_bytes = MAX_BYTES if max_bytes is None else max(max_bytes, 0)
+    # Arrow goes to a file, so only the in-response formats are budgeted
+    budgeted = format != "arrow" and bool(max_rows or max_bytes)
     try:
-        conn = await connect(db_name)
-        
         # Determine if this is a query that returns results
-        query_type = query.strip().upper().split()[0]
+        query_type = query_type_of(query)
         
-        if query_type in ("SELECT", "WITH", "SHOW", "EXPLAIN"):
-            rows = await conn.fetch(query)
-            await conn.close()
-            
-            if not rows:
-                return "Query executed successfully. No results returned."
-            
-            # Format results
-            result_lines = []
-            for row in rows:
-                row_dict = dict(row)
-                result_lines.append(str(row_dict))
-                
-            return "\n".join(result_lines)
-        else:
-            # For non-SELECT queries
-            status = await conn.execute(query)
-            await conn.close()
+        if stream and query_type in ("SELECT", "WITH"):
+            page = await open_stream(db_name, query, max(page_size, 1), format, params, timeout_ms)
+            record_predicates(db_name, query, params)
+            return page
+        
+        # If the MCP request is cancelled, the CancelledError raised here makes
+        # asyncpg send a cancel request for the running statement, and the
+        # connection goes back to the pool.
+        async with connect(db_name, timeout_ms, read_only=replica_safe(query)) as conn:
+            cached = RESULT_CACHE_TTL > 0 and use_cache
+            if budgeted and not cached and query_type in ("SELECT", "WITH") and is_read_query(query):
+                output = await fetch_within_budget(conn, query, params, format, max_rows, max_bytes,
+                                                   client_timeout(timeout_ms))
+                record_predicates(db_name, query, params)
+                return output
+            rows, status = await run_statement(conn, db_name, query, params, use_cache, client_timeout(timeout_ms))
+        record_predicates(db_name, query, params)
+        
+        if status is not None:
             return f"Query executed successfully. Status: {status}"
+        if not rows:
+            return "Query executed successfully. No results returned."
+        if budgeted:
+            text, count, truncated = await encode_within_budget(list_pages(rows), format, max_rows, max_bytes)
+            return budgeted_output(text, count, truncated, len(rows), True, max_rows, max_bytes)
+        
+        return format_rows(rows, format, path)
             
+    except asyncio.TimeoutError:
+        logger.error(f"Query timed out: {query[:200]}")
+        return f"Error executing query: {timeout_message(timeout_ms)}"
     except Exception as e:
         logger.error(f"Query execution error: {e}")
         return f"Error executing query: {str(e)}"
 
+@mcp.tool(name="execute_across_databases", description="Run the same query concurrently on several databases (default: all, as listed by list_databases) and return each database's result and timing. Each database's result stops at max_rows rows or max_bytes characters (server defaults; 0 = unlimited)")
+@timed
+async def execute_across_databases(query: str, databases: Optional[List[str]] = None,
+                                   params: Optional[List[Any]] = None, format: str = "text",
+                                   use_cache: bool = True, timeout_ms: Optional[int] = None,
+                                   max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> str:
+    """Fan a query out over many databases with bounded concurrency."""
+    if format == "arrow":
+        return "Error: The arrow format isn't supported here; use csv, jsonl or columnar-json."
+    error = check_format(format, None)
+    if error:
+        return error
+    params = params or []
+    try:
+        if databases is None:
+            databases = await database_names()
+    except Exception as e:
+        logger.error(f"Error listing databases: {e}")
+        return f"Error: {str(e)}"
+    if not databases:
+        return "No databases found."
+
+    max_rows = MAX_ROWS if max_rows is None else max(max_rows, 0)
+    max_bytes = MAX_BYTES if max_bytes is None else max(max_bytes, 0)
+    budgeted = bool(max_rows or max_bytes)
+    # Uncached reads are fetched through a cursor so no database returns more than its budget
+    cursored = (budgeted and not (RESULT_CACHE_TTL > 0 and use_cache)
+                and query_type_of(query) in ("SELECT", "WITH") and is_read_query(query))
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+    async def run_one(db_name: str) -> str:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                body = None
+                async with connect(db_name, timeout_ms, read_only=replica_safe(query)) as conn:
+                    if cursored:
+                        body = await fetch_within_budget(conn, query, params, format, max_rows, max_bytes,
+                                                         client_timeout(timeout_ms))
+                    else:
+                        rows, status = await run_statement(
+                            conn, db_name, query, params, use_cache, client_timeout(timeout_ms)
+                        )
+                if body is not None:
+                    pass
+                elif status is not None:
+                    body = f"Status: {status}"
+                elif not rows:
+                    body = "No results returned."
+                elif budgeted:
+                    text, count, truncated = await encode_within_budget(list_pages(rows), format, max_rows, max_bytes)
+                    body = budgeted_output(text, count, truncated, len(rows), True, max_rows, max_bytes)
+                else:
+                    body = format_rows(rows, format)
+            except asyncio.TimeoutError:
+                body = f"Error: {timeout_message(timeout_ms)}"
+            except Exception as e:
+                logger.error(f"Query on '{db_name}' failed: {e}")
+                body = f"Error: {str(e)}"
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            return f"== {db_name} ({elapsed_ms:.1f} ms) ==\n{body}"
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_one(db_name) for db_name in databases))
+    total_ms = (time.perf_counter() - started) * 1000
+    return "\n\n".join(results) + f"\n\n[{len(databases)} databases in {total_ms:.1f} ms]"
+
+def written_tables(statements: List[str]) -> Optional[Set[str]]:
+    """Union of tables written by several statements, or None if any is unknown."""
+    written: Set[str] = set()
+    for statement in statements:
+        tables = referenced_tables(normalize_query(statement))
+        if not tables:
+            return None
+        written |= tables
+    return written
+
+@mcp.tool(name="execute_batch", description="Run many statements in one call: either a list of SQL statements, or one query ($1, $2, ... placeholders) with a list of parameter sets sent as a pipelined executemany. atomic=True (default) runs everything in one transaction; atomic=False reports a status per statement")
+@timed
+async def execute_batch(db_name: str, statements: Optional[List[str]] = None, query: Optional[str] = None,
+                        params_list: Optional[List[List[Any]]] = None, atomic: bool = True,
+                        timeout_ms: Optional[int] = None) -> str:
+    """Batch statements to avoid one tool call and round trip per statement."""
+    if (statements is None) == (query is None):
+        return "Error: Pass either statements, or query with params_list."
+    if query is not None and not params_list:
+        return "Error: params_list must hold at least one parameter set."
+    if statements is not None and not statements:
+        return "Error: statements is empty."
+    timeout = client_timeout(timeout_ms)
+    started = time.perf_counter()
+    try:
+        async with connect(db_name, timeout_ms) as conn:
+            if query is not None and atomic:
+                # executemany pipelines every parameter set over one round trip
+                async with conn.transaction():
+                    await conn.executemany(query, params_list, timeout=timeout)
+                invalidate_results(db_name, query)
+                summary = f"Executed {len(params_list)} parameter sets atomically"
+            elif statements is not None and atomic:
+                # A multi-statement script is sent as one message
+                script = ";\n".join(statement.strip().rstrip(";") for statement in statements)
+                async with conn.transaction():
+                    status = await conn.execute(script, timeout=timeout)
+                invalidate_results(db_name, written=written_tables(statements) or set())
+                summary = f"Executed {len(statements)} statements atomically (last status: {status})"
+            else:
+                work = [(query, params) for params in params_list] if query is not None else [(statement, []) for statement in statements]
+                lines = []
+                attempted = 0
+                try:
+                    for i, (sql, params) in enumerate(work, 1):
+                        attempted = i
+                        try:
+                            if params:
+                                status = await execute_prepared(conn, sql, params, timeout)
+                            else:
+                                status = await conn.execute(sql, timeout=timeout)
+                            lines.append(f"{i}. {status}")
+                        except asyncpg.PostgresError as e:
+                            lines.append(f"{i}. Error: {str(e)}")
+                finally:
+                    # Each statement commits on its own, so a timeout or cancellation
+                    # part-way still leaves the earlier writes in place
+                    if attempted:
+                        invalidate_results(db_name, written=written_tables([sql for sql, _ in work[:attempted]]) or set())
+                failed = sum(1 for line in lines if ". Error: " in line)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                return "\n".join(lines) + f"\n[{len(work) - failed} succeeded, {failed} failed in {elapsed_ms:.1f} ms]"
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        return f"{summary} in {elapsed_ms:.1f} ms."
+    except asyncio.TimeoutError:
+        return f"Error: {timeout_message(timeout_ms)} Nothing was committed." if atomic else f"Error: {timeout_message(timeout_ms)}"
+    except Exception as e:
+        logger.error(f"Batch execution error: {e}")
+        if atomic:
+            return f"Error: {str(e)}. The batch was rolled back; nothing was committed."
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="begin_transaction", description="Start a transaction that spans several tool calls; returns a handle for execute_in_transaction, commit_transaction and rollback_transaction")
+@timed
+async def begin_transaction(db_name: str, isolation: str = "read_committed", read_only: bool = False) -> str:
+    """Pin a pooled connection and open a transaction on it."""
+    if isolation not in TRANSACTION_ISOLATION:
+        return f"Error: Unknown isolation '{isolation}'. Use one of: {', '.join(TRANSACTION_ISOLATION)}"
+    try:
+        handle = await begin_handle(db_name, isolation, read_only)
+        return (
+            f"Transaction started. Handle: {handle}\n"
+            f"[rolled back automatically after {TRANSACTION_TTL:.0f}s without activity]"
+        )
+    except Exception as e:
+        logger.error(f"Error starting transaction: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="execute_in_transaction", description="Run a statement inside a transaction opened with begin_transaction. Use $1, $2, ... placeholders with params")
+@timed
+async def execute_in_transaction(handle: str, query: str, params: Optional[List[Any]] = None, format: str = "text",
+                                 timeout_ms: Optional[int] = None, max_rows: Optional[int] = None,
+                                 max_bytes: Optional[int] = None) -> str:
+    """Execute one statement on the transaction's pinned connection."""
+    if format == "arrow":
+        return "Error: The arrow format isn't supported here; use csv, jsonl or columnar-json."
+    error = check_format(format, None)
+    if error:
+        return error
+    state = _transactions.get(handle)
+    if state is None:
+        return "Error: Unknown or expired transaction handle."
+    params = params or []
+    timeout = client_timeout(timeout_ms)
+    async with state["lock"]:
+        if handle not in _transactions:
+            return "Error: Unknown or expired transaction handle."
+        conn = state["conn"]
+        try:
+            await apply_timeout(conn, timeout_ms, local=True)
+            if is_read_query(query) or query_type_of(query) == "WITH":
+                # Reads skip the result cache so they see the transaction's own writes
+                rows, status = await run_prepared(conn, query, params, timeout), None
+            elif params:
+                rows, status = None, await execute_prepared(conn, query, params, timeout)
+            else:
+                rows, status = None, await conn.execute(query, timeout=timeout)
+            if timeout_ms is not None and timeout_ms != STATEMENT_TIMEOUT_MS:
+                # SET LOCAL lasts until the transaction ends; later statements get the default again
+                await conn.execute("SET LOCAL statement_timeout TO DEFAULT")
+        except (Exception, asyncio.CancelledError) as e:
+            # The transaction is aborted either way; release the connection now
+            await asyncio.shield(end_handle(handle, commit=False))
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            if isinstance(e, asyncio.TimeoutError):
+                return f"Error: {timeout_message(timeout_ms)} The transaction was rolled back."
+            logger.error(f"Error in transaction: {e}")
+            return f"Error: {str(e)}. The transaction was rolled back."
+        state["statements"] += 1
+        state["last_used"] = time.monotonic()
+        if not is_read_query(query) and state["written"] is not None:
+            tables = referenced_tables(normalize_query(query))
+            if tables:
+                state["written"] |= tables
+            else:
+                state["written"] = None
+    if status is not None:
+        return f"Statement executed. Status: {status}"
+    if not rows:
+        return "Statement executed. No results returned."
+    max_rows = MAX_ROWS if max_rows is None else max(max_rows, 0)
+    max_bytes = MAX_BYTES if max_bytes is None else max(max_bytes, 0)
+    if not (max_rows or max_bytes):
+        return format_rows(rows, format)
+    text, count, truncated = await encode_within_budget(list_pages(rows), format, max_rows, max_bytes)
+    return budgeted_output(text, count, truncated, len(rows), True, max_rows, max_bytes)
+
+@mcp.tool(name="commit_transaction", description="Commit a transaction opened with begin_transaction")
+@timed
+async def commit_transaction(handle: str) -> str:
+    """Commit and release the pinned connection."""
+    state = _transactions.get(handle)
+    if state is None:
+        return "Error: Unknown or expired transaction handle."
+    try:
+        async with state["lock"]:
+            statements = await end_handle(handle, commit=True)
+        if statements is None:
+            return "Error: Unknown or expired transaction handle."
+        return f"Transaction committed ({statements} statements)."
+    except Exception as e:
+        logger.error(f"Error committing transaction: {e}")
+        return f"Error: {str(e)}. The transaction was rolled back."
+
+@mcp.tool(name="rollback_transaction", description="Roll back a transaction opened with begin_transaction")
+@timed
+async def rollback_transaction(handle: str) -> str:
+    """Roll back and release the pinned connection."""
+    state = _transactions.get(handle)
+    if state is None:
+        return "Error: Unknown or expired transaction handle."
+    try:
+        async with state["lock"]:
+            statements = await end_handle(handle, commit=False)
+        if statements is None:
+            return "Error: Unknown or expired transaction handle."
+        return f"Transaction rolled back ({statements} statements discarded)."
+    except Exception as e:
+        logger.error(f"Error rolling back transaction: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="subscribe", description="LISTEN on a channel and buffer its NOTIFY messages; returns a subscription id for poll_notifications. Notifications are also pushed to the client as log messages when push=True")
+@timed
+async def subscribe(db_name: str, channel: str, ctx: Context, push: bool = True) -> str:
+    """Start listening on a channel over the database's listener connection."""
+    try:
+        subscription_id = await add_subscription(db_name, channel, ctx.session if push else None)
+        return (
+            f"Subscribed to '{channel}'. Subscription id: {subscription_id}\n"
+            f"[the newest {NOTIFY_BUFFER_SIZE} notifications are kept until polled]"
+        )
+    except Exception as e:
+        logger.error(f"Error subscribing to '{channel}': {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="poll_notifications", description="Return the notifications buffered for a subscription, waiting up to wait_ms (max 60000) for one to arrive if none are pending")
+@timed
+async def poll_notifications(subscription_id: str, wait_ms: int = 0) -> str:
+    """Drain a subscription's buffer, long-polling while it is empty."""
+    state = _subscriptions.get(subscription_id)
+    if state is None:
+        return "Error: Unknown subscription id."
+    wait_ms = min(max(wait_ms, 0), NOTIFY_MAX_WAIT_MS)
+    if not state["buffer"] and not state["lost"] and wait_ms:
+        state["event"].clear()
+        try:
+            await asyncio.wait_for(state["event"].wait(), timeout=wait_ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+    notes = list(state["buffer"])
+    state["buffer"].clear()
+    lines = [format_notifications(notes)] if notes else []
+    if state["dropped"]:
+        lines.append(f"[{state['dropped']} older notifications were dropped because the buffer was full]")
+        state["dropped"] = 0
+    if state["lost"]:
+        state["lost"] = False
+        try:
+            await listener_connection(state["db_name"])
+            lines.append("[the listener connection was lost and has been reopened; notifications sent meanwhile were missed]")
+        except Exception as e:
+            state["lost"] = True
+            logger.error(f"Error reopening listener connection: {e}")
+            lines.append(f"Error: The listener connection was lost and could not be reopened: {str(e)}")
+    return "\n".join(lines) if lines else "No notifications."
+
+@mcp.tool(name="unsubscribe", description="Stop a subscription created with subscribe")
+@timed
+async def unsubscribe(subscription_id: str) -> str:
+    """UNLISTEN and discard any buffered notifications."""
+    try:
+        if not await remove_subscription(subscription_id):
+            return "Error: Unknown subscription id."
+        return "Unsubscribed."
+    except Exception as e:
+        logger.error(f"Error unsubscribing: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="fetch_more", description="Fetch the next page of a streamed execute_query result using its continuation token")
+@timed
+async def fetch_more(token: str, page_size: int = STREAM_PAGE_SIZE) -> str:
+    """Resume an open server-side cursor."""
+    try:
+        return await fetch_stream(token, max(page_size, 1))
+    except Exception as e:
+        logger.error(f"Error fetching from cursor: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="close_cursor", description="Close a streamed execute_query result before it is exhausted")
+@timed
+async def close_cursor(token: str) -> str:
+    """Release the connection held by an open cursor."""
+    state = _cursors.get(token)
+    if state is None:
+        return "Error: Unknown or expired continuation token."
+    async with state["lock"]:
+        await close_stream(token)
+    return "Cursor closed."
+
+@mcp.tool(name="import_file", description="Bulk-load a local csv, tsv or binary (COPY format) file into a table with COPY")
+@timed
+async def import_file(db_name: str, table: str, path: str, format: str = "csv", header: bool = True,
+                      schema: Optional[str] = None, timeout_ms: int = 0) -> str:
+    """Stream a file into a table with COPY FROM STDIN."""
+    if format not in COPY_FORMATS:
+        return f"Error: Unknown format '{format}'. Use one of: {', '.join(COPY_FORMATS)}"
+    if not os.path.isfile(path):
+        return f"Error: '{path}' is not a file."
+    try:
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        async with connect(db_name, timeout_ms) as conn:
+            status = await conn.copy_to_table(
+                table, source=read_chunks(path), schema_name=schema, timeout=client_timeout(timeout_ms),
+                **copy_options(format, header)
+            )
+        elapsed = time.perf_counter() - started
+        invalidate_results(db_name, written={table})
+        return f"Imported {throughput(copy_row_count(status), size, elapsed)} into '{table}'."
+    except asyncio.TimeoutError:
+        return f"Error: {timeout_message(timeout_ms)}"
+    except Exception as e:
+        logger.error(f"Error importing '{path}' into '{table}': {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="export_query", description="Export a query's results straight to a local csv, tsv or binary file with COPY TO (optionally gzip-compressed)")
+@timed
+async def export_query(db_name: str, query: str, path: str, format: str = "csv", header: bool = True,
+                       compress: bool = False, timeout_ms: int = 0) -> str:
+    """Stream COPY (query) TO STDOUT into a file; memory use doesn't grow with the result."""
+    if format not in COPY_FORMATS:
+        return f"Error: Unknown format '{format}'. Use one of: {', '.join(COPY_FORMATS)}"
+    compress = compress or path.endswith(".gz")
+    try:
+        started = time.perf_counter()
+        f = await asyncio.to_thread(gzip.open if compress else open, path, "wb")
+        try:
+            async with connect(db_name, timeout_ms, read_only=replica_safe(query)) as conn:
+                status = await conn.copy_from_query(
+                    query.strip().rstrip(";"), output=f, timeout=client_timeout(timeout_ms),
+                    **copy_options(format, header)
+                )
+        finally:
+            await asyncio.to_thread(f.close)
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(path)
+        kind = "gzip-compressed " if compress else ""
+        return f"Exported {throughput(copy_row_count(status), size, elapsed)} to {kind}'{path}'."
+    except asyncio.TimeoutError:
+        return f"Error: {timeout_message(timeout_ms)}"
+    except Exception as e:
+        logger.error(f"Error exporting query to '{path}': {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="profile_query", description="Run EXPLAIN (ANALYZE, BUFFERS) on a query inside a rolled-back transaction and summarize its hotspots")
+@timed
+async def profile_query(db_name: str, query: str, params: Optional[List[Any]] = None,
+                        timeout_ms: Optional[int] = None) -> str:
+    """Profile a query: slowest nodes, bad row estimates, large seq scans and buffer usage."""
+    timeout = client_timeout(timeout_ms)
+    try:
+        async with connect(db_name, timeout_ms) as conn:
+            tr = conn.transaction()
+            await tr.start()
+            try:
+                # ANALYZE really executes the statement; the rollback undoes any writes
+                raw = await conn.fetchval(
+                    "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query.strip().rstrip(";"),
+                    *(params or []), timeout=timeout
+                )
+                explain = raw[0]
+                relations = sorted({
+                    node["relation"] for node in plan_nodes(explain["Plan"])
+                    if node["type"] == "Seq Scan" and node["relation"]
+                })
+                rows = await conn.fetch(
+                    "SELECT relname, max(reltuples)::bigint AS reltuples FROM pg_class "
+                    "WHERE relname = ANY($1::text[]) AND relkind IN ('r', 'p', 'm') GROUP BY relname;",
+                    relations, timeout=timeout
+                ) if relations else []
+            finally:
+                await asyncio.shield(tr.rollback())
+        return summarize_profile(explain, {row["relname"]: row["reltuples"] for row in rows})
+    except asyncio.TimeoutError:
+        return f"Error: {timeout_message(timeout_ms)}"
+    except Exception as e:
+        logger.error(f"Error profiling query: {e}")
+        return f"Error: {str(e)}"
+
+@mcp.tool(name="query_insights", description="Show where time goes: the top statements from pg_stat_statements (by total_time, mean_time, calls or reads, with cache hit ratios) and this server's per-tool latency histograms for pool wait, execute and serialize time")
+@timed
+async def query_insights(db_name: str, order_by: str = "total_time", limit: int = 10) -> str:
+    """Merge pg_stat_statements with the server's own latency histograms."""
+    if order_by not in STAT_STATEMENTS_ORDER:
+        return f"Error: Unknown order_by '{order_by}'. Use one of: {', '.join(STAT_STATEMENTS_ORDER)}"
+    try:
+        async with connect(db_name) as conn:
+            installed = await conn.fetchval("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+            if not installed:
+                statements = (
+                    "pg_stat_statements is not installed in this database. Add it to shared_preload_libraries "
+                    "and run CREATE EXTENSION pg_stat_statements; to see per-statement stats."
+                )
+            else:
+                modern = conn.get_server_version().major >= 13
+                query = STAT_STATEMENTS_SQL.format(
+                    total="total_exec_time" if modern else "total_time",
+                    mean="mean_exec_time" if modern else "mean_time",
+                    order=STAT_STATEMENTS_ORDER[order_by],
+                )
+                try:
+                    rows = await conn.fetch(query, max(limit, 1))
+                    statements = format_statement_stats(rows, order_by) if rows else "pg_stat_statements has no statements for this database yet."
+                except asyncpg.PostgresError as e:
+                    # Typically: installed but not loaded through shared_preload_libraries
+                    statements = f"pg_stat_statements is unavailable: {str(e)}"
+    except Exception as e:
+        logger.error(f"Error reading query insights: {e}")
+        statements = f"Error: {str(e)}"
+    return statements + "\n\n" + format_latency()
+
+@mcp.tool(name="suggest_indexes", description="Propose indexes for a schema, ranked by estimated benefit, from the table scan statistics and the WHERE/JOIN predicates of queries run through execute_query. Candidates are checked with hypothetical-index EXPLAIN when the hypopg extension is installed")
+@timed
+async def suggest_indexes(db_name: str, schema: str = "public", limit: int = 5) -> str:
+    """Combine pg_stat_user_tables with the predicate log into CREATE INDEX candidates."""
+    log = _predicate_log.get(db_name, {})
+    try:
+        async with connect(db_name) as conn:
+            stats = {row["table_name"]: row for row in await conn.fetch(INDEX_SCAN_STATS_SQL, schema)}
+            indexes: Dict[str, List[List[str]]] = {}
+            for row in await conn.fetch(INDEX_KEYS_SQL, schema):
+                indexes.setdefault(row["table_name"], []).append(list(row["columns"]))
+            logged_tables = sorted({table for table, _, _ in log})
+            columns = {
+                row["table_name"]: set(row["columns"])
+                for row in await conn.fetch(TABLE_COLUMNS_SQL, schema, logged_tables)
+            }
+            candidates = index_candidates(log, stats, columns, indexes)[:max(limit, 1)]
+            hypopg = candidates and await conn.fetchval("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")
+
+            lines = []
+            for i, candidate in enumerate(candidates, 1):
+                definition = (
+                    f"CREATE INDEX ON {quote_ident(schema)}.{quote_ident(candidate['table'])} "
+                    f"({', '.join(quote_ident(column) for column in candidate['columns'])})"
+                )
+                used_for = [f"equality/join on {', '.join(candidate['equality'])}"] if candidate["equality"] else []
+                if candidate["range"]:
+                    used_for.append(f"range on {candidate['range']}")
+                lines += [
+                    f"{i}. {definition};",
+                    f"   {candidate['uses']} logged uses ({'; '.join(used_for)})",
+                    f"   {candidate['table']}: {format_scan_stats(candidate['stat'])}",
+                ]
+                if hypopg:
+                    try:
+                        before, after, used = await hypothetical_costs(conn, definition, candidate["sample"])
+                        if used:
+                            lines.append(f"   hypopg: estimated cost {before:.1f} -> {after:.1f} for a logged query")
+                        else:
+                            lines.append(f"   hypopg: the planner would not use this index for a logged query (cost {before:.1f})")
+                    except Exception as e:
+                        lines.append(f"   hypopg: couldn't check against a logged query: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error suggesting indexes: {e}")
+        return f"Error: {str(e)}"
+
+    if candidates:
+        header = f"Index candidates for schema '{schema}', ranked by logged uses x live rows x share of sequential scans:"
+        if not hypopg:
+            lines.append("(install the hypopg extension to have candidates checked with hypothetical-index EXPLAIN)")
+    elif log:
+        header = "No index candidates: logged predicates are on small tables or already covered by existing indexes."
+    else:
+        header = "No predicates logged yet; suggestions come from queries run through execute_query."
+    # Large tables read mostly sequentially are worth a look even without a candidate
+    suggested = {candidate["table"] for candidate in candidates}
+    scanned = sorted(
+        (stat for table, stat in stats.items()
+         if table not in suggested and (stat["n_live_tup"] or 0) >= INDEX_MIN_ROWS
+         and (stat["seq_scan"] or 0) > stat["idx_scan"]),
+        key=lambda stat: -(stat["seq_tup_read"] or 0)
+    )[:5]
+    if scanned:
+        lines.append("Tables read mostly by sequential scans, with no logged predicates to base an index on:")
+        lines += [f"  {stat['table_name']}: {format_scan_stats(stat)}" for stat in scanned]
+    return "\n".join([header] + lines)
+
+@mcp.tool(name="cache_stats", description="Show hit/miss counters for the server's caches")
+@timed
+async def cache_stats() -> str:
+    """Report prepared statement and result cache counters."""
+    def hit_rate(stats):
+        lookups = stats["hits"] + stats["misses"]
+        return f"{stats['hits'] / lookups:.1%}" if lookups else "n/a"
+
+    stats = statement_cache_stats
+    cached = sum(len(cache) for cache in _statement_caches.values())
+    lines = [
+        f"Prepared statements (estimated): {stats['hits']} hits, {stats['misses']} misses, "
+        f"{stats['evictions']} evictions, hit rate {hit_rate(stats)}, {cached} cached"
+    ]
+    if RESULT_CACHE_TTL > 0:
+        stats = result_cache_stats
+        lines.append(
+            f"Results: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['invalidations']} invalidations, hit rate {hit_rate(stats)}, {len(_result_cache)} cached"
+        )
+    else:
+        lines.append("Results: cache disabled (set PG_RESULT_CACHE_TTL to enable)")
+    return "\n".join(lines)
+
 @mcp.tool(name="hello_postgres", description="Test connection to the server")
+@timed
 async def hello_postgres(name: str = "World") -> str:
     """Simple test function."""
     logger.info(f"Hello function called with name: {name}")
@@ -0,0 +1,43 @@
+"""
+Statement cache behaviour against a live PostgreSQL. Set PG_TEST_DSN
+(e.g. postgresql://postgres@localhost/postgres) to run; skipped otherwise.
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+pytest.importorskip("mcp")
+pytest.importorskip("dotenv")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import postgres_mcp_server_for_claude as server
+
+DSN = os.getenv("PG_TEST_DSN")
+pytestmark = pytest.mark.skipif(not DSN, reason="PG_TEST_DSN is not set")
+
+
+def test_same_query_twice_through_pool():
+    async def run():
+        # One connection, so the second acquire gets the connection the first released
+        pool = await asyncpg.create_pool(DSN, min_size=1, max_size=1, init=server.init_connection,
+                                         statement_cache_size=server.STATEMENT_CACHE_SIZE)
+        try:
+            before = dict(server.statement_cache_stats)
+            results = []
+            for query in ("SELECT $1::int + 1 AS n", "SELECT  $1::int + 1  AS n -- again"):
+                async with pool.acquire() as conn:
+                    results.append(await server.run_prepared(conn, query, [41]))
+            async with pool.acquire() as conn:
+                status = await server.execute_prepared(conn, "SELECT $1::int", [1])
+        finally:
+            await pool.close()
+        return before, results, status
+
+    before, results, status = asyncio.run(run())
+    assert [rows[0]["n"] for rows in results] == [42, 42]
+    assert status == "SELECT 1"
+    assert server.statement_cache_stats["hits"] == before["hits"] + 1
+    assert server.statement_cache_stats["misses"] == before["misses"] + 2